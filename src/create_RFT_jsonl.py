@@ -11,20 +11,198 @@ Slack エクスポート JSON ファイルから RFT 用の JSONL ファイル
   python generate_rft_jsonl.py \
     --input_dir ./slack_export \
     --user_id U12345678 \
+    --output_file rft_data.jsonl \
+    [--workers 8] [--manifest rft_manifest.json]
+
+  インデックスを使う場合（初回に作成し、以降は --input_dir なしでクエリのみ）:
+  python generate_rft_jsonl.py \
+    --index slack_index.sqlite \
+    [--input_dir ./slack_export] \
+    --user_id U12345678 \
     --output_file rft_data.jsonl
 """
 import os
 import json
 import glob
 import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+from slack_index import SlackIndex
+from slack_manifest import FileManifest, file_sha256
+
+def parse_file(filepath):
+    """
+    1ファイルを読み込み、スレッド構造のレコードを返す
+    {"parents": [[thread_ts, 親メッセージ], ...], "replies": [[thread_ts, 返信メッセージ], ...]}
+    """
+    records = {"parents": [], "replies": []}
+    with open(filepath, "r", encoding="utf-8") as f:
+        try:
+            data = json.load(f)
+        except Exception as e:
+            print(f"{filepath} の読み込みエラー: {e}")
+            return records
+    if not isinstance(data, list):
+        return records
+    for msg in data:
+        if not isinstance(msg, dict):
+            continue
+        text = msg.get("text")
+        user = msg.get("user")
+        if not text or not user:
+            continue
+        ts = msg.get("ts")
+        thread_ts = msg.get("thread_ts", ts)
+        # 出力に使うフィールドだけを保持する（ワーカー間の転送量・マニフェストサイズ削減のため）
+        msg = {"user": user, "text": text, "ts": ts}
+        if ts == thread_ts:
+            records["parents"].append([thread_ts, msg])
+        else:
+            records["replies"].append([thread_ts, msg])
+    return records
+
+def merge_records(records_list, parent_msgs=None, thread_replies=None):
+    """
+    ファイル単位のレコードを順にマージし、(親メッセージ, スレッド返信) のマップを返す
+    parent_msgs: thread_ts -> 親メッセージ
+    thread_replies: thread_ts -> 返信メッセージのリスト（読み込み順）
+    """
+    if parent_msgs is None:
+        parent_msgs = {}
+    if thread_replies is None:
+        thread_replies = {}
+    for records in records_list:
+        for thread_ts, msg in records["parents"]:
+            parent_msgs[thread_ts] = msg
+        for thread_ts, msg in records["replies"]:
+            thread_replies.setdefault(thread_ts, []).append(msg)
+    return parent_msgs, thread_replies
+
+def parse_files(filepaths):
+    """JSON ファイル群を読み込み、(親メッセージ, スレッド返信) のマップを返す"""
+    return merge_records(parse_file(filepath) for filepath in filepaths)
+
+def parse_files_parallel(filepaths, workers):
+    """
+    チャンネルディレクトリ単位でシャードに分割し、プロセスプールで並列に読み込む。
+    シャードはファイルの列挙順を保ったまま連続区間で切り出し、結果も同じ順で
+    マージするため、シリアル実行と同一の結果（出力はバイト単位で一致）になる。
+    """
+    shards = [list(group) for _, group in itertools.groupby(filepaths, key=os.path.dirname)]
+    parent_msgs = {}
+    thread_replies = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for partial_parents, partial_replies in executor.map(parse_files, shards):
+            parent_msgs.update(partial_parents)
+            for thread_ts, replies in partial_replies.items():
+                thread_replies.setdefault(thread_ts, []).extend(replies)
+    return parent_msgs, thread_replies
+
+def _thread_keys(records):
+    return {thread_ts for thread_ts, _ in records["parents"]} | {thread_ts for thread_ts, _ in records["replies"]}
+
+def parse_files_incremental(filepaths, manifest, workers=1):
+    """
+    マニフェストを使い、新規・変更ファイルだけを再パースしてスレッド構造を組み立てる。
+    戻り値: (parent_msgs, thread_replies, affected) ─ affected は内容が変わった可能性のある thread_ts の集合
+    """
+    records_by_file = {}
+    changed = []
+    for filepath in filepaths:
+        st = os.stat(filepath)
+        records, digest = manifest.lookup(filepath, st.st_size, st.st_mtime_ns,
+                                          lambda: file_sha256(filepath))
+        if records is None:
+            changed.append((filepath, st, digest))
+        else:
+            records_by_file[filepath] = records
+
+    changed_paths = [filepath for filepath, _, _ in changed]
+    if workers > 1 and len(changed_paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed = list(executor.map(parse_file, changed_paths, chunksize=16))
+    else:
+        parsed = [parse_file(filepath) for filepath in changed_paths]
+
+    affected = set()
+    for (filepath, st, digest), records in zip(changed, parsed):
+        old = manifest.files.get(filepath)
+        if old:
+            affected |= _thread_keys(old["records"])
+        affected |= _thread_keys(records)
+        manifest.put(filepath, st.st_size, st.st_mtime_ns, digest, records)
+        records_by_file[filepath] = records
+    removed = manifest.remove_missing(filepaths)
+    for entry in removed.values():
+        affected |= _thread_keys(entry["records"])
+    print(f"再パース: {len(changed)} ファイル / 再利用: {len(filepaths) - len(changed)} ファイル / 削除: {len(removed)} ファイル")
+
+    parent_msgs, thread_replies = merge_records(records_by_file[filepath] for filepath in filepaths)
+    return parent_msgs, thread_replies, affected
+
+def load_from_index(index, my_id):
+    """
+    SQLite インデックスから (親メッセージ, スレッド返信) のマップを組み立てる。
+    返信は自分の返信だけを thread_ts・ts 順に取得するため、JSON の再読み込みも全件のソートも不要
+    """
+    parent_msgs = {}
+    for thread_ts, msg in index.iter_thread_parents():
+        parent_msgs[thread_ts] = msg
+    thread_replies = {}
+    for thread_ts, msg in index.iter_user_replies(my_id):
+        thread_replies.setdefault(thread_ts, []).append(msg)
+    return parent_msgs, thread_replies
+
+def build_thread_lines(thread_ts, parent, thread_replies, my_id):
+    """
+    1スレッド分の出力行を返す: (質問→自分の返信 の行, 自分自身の投稿の行)
+    該当しない場合はそれぞれ None
+    """
+    if parent.get("user") == my_id:
+        # 自分自身の投稿
+        text = parent.get("text", "").strip()
+        item = {
+            "messages": [{"role": "user", "content": text}],
+            "compliant": "yes",
+            "explanation": text
+        }
+        return None, json.dumps(item, ensure_ascii=False) + "\n"
+
+    # 他ユーザーからの質問 → 自分の返信
+    question = parent.get("text", "").strip()
+    if not question.endswith(("?", "？")):
+        return None, None
+    replies = sorted(thread_replies.get(thread_ts, []), key=lambda x: x.get("ts"))
+    answer = next((r for r in replies if r.get("user") == my_id), None)
+    if not answer:
+        return None, None
+    item = {
+        "messages": [{"role": "user", "content": question}],
+        "compliant": "yes",
+        "explanation": answer.get("text", "").strip()
+    }
+    return json.dumps(item, ensure_ascii=False) + "\n", None
+
+def write_rft_jsonl(output_file, parent_msgs, thread_lines):
+    """質問→返信の行をすべて書き出した後、自分自身の投稿の行を書き出す"""
+    with open(output_file, "w", encoding="utf-8") as out_f:
+        for thread_ts in parent_msgs:
+            qa_line, _ = thread_lines[thread_ts]
+            if qa_line:
+                out_f.write(qa_line)
+        for thread_ts in parent_msgs:
+            _, self_line = thread_lines[thread_ts]
+            if self_line:
+                out_f.write(self_line)
 
 def main():
     parser = argparse.ArgumentParser(
         description="Slack JSON から RFT 用 JSONL を生成"
     )
     parser.add_argument(
-        "--input_dir", required=True,
-        help="Slack JSON ファイルが格納されたディレクトリ"
+        "--input_dir",
+        help="Slack JSON ファイルが格納されたディレクトリ（--index 指定時は省略するとインデックスをそのまま使う）"
     )
     parser.add_argument(
         "--user_id", required=True,
@@ -34,68 +212,68 @@ def main():
         "--output_file", required=True,
         help="出力する JSONL ファイルのパス"
     )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="並列に JSON を読み込むプロセス数（1 の場合はシリアル実行）"
+    )
+    parser.add_argument(
+        "--manifest",
+        help="処理済みファイルのマニフェスト（指定すると新規・変更ファイルだけを再パースする）"
+    )
+    parser.add_argument(
+        "--index",
+        help="メッセージの SQLite インデックス（slack.py と共有可能）。指定するとインデックスへのクエリで生成する"
+    )
     args = parser.parse_args()
+    if not args.input_dir and not args.index:
+        parser.error("--input_dir または --index を指定してください")
 
     input_dir = args.input_dir
     my_id = args.user_id
     output_file = args.output_file
 
-    parent_msgs = {}
-    thread_replies = {}
-
-    for filepath in glob.glob(os.path.join(input_dir, "**", "*.json"), recursive=True):
-        with open(filepath, "r", encoding="utf-8") as f:
-            try:
-                data = json.load(f)
-            except Exception as e:
-                print(f"{filepath} の読み込みエラー: {e}")
-                continue
-        if not isinstance(data, list):
-            continue
-        for msg in data:
-            if not isinstance(msg, dict):
-                continue
-            text = msg.get("text")
-            user = msg.get("user")
-            if not text or not user:
-                continue
-            ts = msg.get("ts")
-            thread_ts = msg.get("thread_ts", ts)
-            if ts == thread_ts:
-                parent_msgs[thread_ts] = msg
-            else:
-                thread_replies.setdefault(thread_ts, []).append(msg)
+    if args.index:
+        index = SlackIndex(args.index)
+        if input_dir:
+            index.update(input_dir)
+        parent_msgs, thread_replies = load_from_index(index, my_id)
+        index.close()
+        thread_lines = {
+            thread_ts: build_thread_lines(thread_ts, parent, thread_replies, my_id)
+            for thread_ts, parent in parent_msgs.items()
+        }
+        write_rft_jsonl(output_file, parent_msgs, thread_lines)
+        print(f"完了: {output_file} に出力しました。")
+        return
 
-    with open(output_file, "w", encoding="utf-8") as out_f:
-        # 他ユーザーからの質問 → 自分の返信
+    filepaths = glob.glob(os.path.join(input_dir, "**", "*.json"), recursive=True)
+    if args.manifest:
+        manifest = FileManifest(args.manifest)
+        parent_msgs, thread_replies, affected = parse_files_incremental(filepaths, manifest, args.workers)
+        # 出力行のキャッシュは user_id ごとに有効
+        cache = manifest.state.get("lines", {}) if manifest.state.get("user_id") == my_id else {}
+        thread_lines = {}
+        rebuilt = 0
         for thread_ts, parent in parent_msgs.items():
-            if parent.get("user") == my_id:
-                continue
-            question = parent.get("text", "").strip()
-            if not question.endswith(("?", "？")):
-                continue
-            replies = sorted(thread_replies.get(thread_ts, []), key=lambda x: x.get("ts"))
-            answer = next((r for r in replies if r.get("user") == my_id), None)
-            if not answer:
-                continue
-            item = {
-                "messages": [{"role": "user", "content": question}],
-                "compliant": "yes",
-                "explanation": answer.get("text", "").strip()
-            }
-            out_f.write(json.dumps(item, ensure_ascii=False) + "\n")
-
-        # 自分自身の投稿
-        for msg in parent_msgs.values():
-            if msg.get("user") != my_id:
-                continue
-            text = msg.get("text", "").strip()
-            item = {
-                "messages": [{"role": "user", "content": text}],
-                "compliant": "yes",
-                "explanation": text
-            }
-            out_f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            if thread_ts in cache and thread_ts not in affected:
+                thread_lines[thread_ts] = tuple(cache[thread_ts])
+            else:
+                thread_lines[thread_ts] = build_thread_lines(thread_ts, parent, thread_replies, my_id)
+                rebuilt += 1
+        print(f"再生成したスレッド数: {rebuilt} / {len(parent_msgs)}")
+        write_rft_jsonl(output_file, parent_msgs, thread_lines)
+        manifest.state = {"user_id": my_id, "lines": thread_lines}
+        manifest.save()
+    else:
+        if args.workers > 1:
+            parent_msgs, thread_replies = parse_files_parallel(filepaths, args.workers)
+        else:
+            parent_msgs, thread_replies = parse_files(filepaths)
+        thread_lines = {
+            thread_ts: build_thread_lines(thread_ts, parent, thread_replies, my_id)
+            for thread_ts, parent in parent_msgs.items()
+        }
+        write_rft_jsonl(output_file, parent_msgs, thread_lines)
 
     print(f"完了: {output_file} に出力しました。")
 
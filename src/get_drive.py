@@ -1,209 +1,1068 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import argparse
 import json
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from io import BytesIO
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 
+from jsonl_writer import JsonlWriter
+
 SCOPES = [
     'https://www.googleapis.com/auth/drive.readonly',
     'https://www.googleapis.com/auth/spreadsheets.readonly'
 ]
 SERVICE_ACCOUNT_FILE = 'service_account/slack-ai-52557-df876200708f.json'  # 適宜変更してください
 
-creds = service_account.Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-drive_service = build('drive', 'v3', credentials=creds)
+# Drive API のユーザー単位クォータに合わせたリクエストレート（リクエスト/秒）と瞬間的なバースト上限
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 20
+MAX_RETRIES = 6
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+# バッチHTTPリクエスト1回にまとめられる呼び出し数の上限
+BATCH_LIMIT = 100
+DOMAIN = "techfund.jp"
+PERMISSION_FIELDS = "permissions(id, type, role, emailAddress, displayName, domain)"
+FOLDER_MIME = "application/vnd.google-apps.folder"
+# そのままダウンロードしてローカルで解析するファイル形式
+DOWNLOAD_KINDS = {
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": "pptx",
+    "application/pdf": "pdf",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+}
+# 1ドキュメントの解析上限（PDF のページ数・PPTX のスライド数、XLSX のシートあたり行数）と解析のタイムアウト（秒）
+DEFAULT_MAX_PAGES = 1000
+DEFAULT_MAX_ROWS = 50000
+DEFAULT_PARSE_TIMEOUT = 120
+# ダウンロードのチャンクサイズ、メモリに置く上限（超えたら一時ファイルに書き出す）、取得するファイルサイズの上限（バイト）
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_SPOOL_THRESHOLD = 16 * 1024 * 1024
+DEFAULT_MAX_FILE_SIZE = 200 * 1024 * 1024
+# 同時に一覧を取得するフォルダ数
+DEFAULT_LIST_WORKERS = 4
+CHANGE_FIELDS = ("nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, mimeType, parents, "
+                 f"size, trashed, webViewLink, createdTime, modifiedTime, owners, {PERMISSION_FIELDS}))")
+
+_creds = None
+_thread_local = threading.local()
+
+def get_creds():
+    global _creds
+    if _creds is None:
+        _creds = service_account.Credentials.from_service_account_file(
+            SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+    return _creds
+
+def get_drive_service():
+    """スレッドごとに Drive サービスを生成して返す（httplib2 はスレッドセーフではないため）"""
+    service = getattr(_thread_local, "drive_service", None)
+    if service is None:
+        service = build('drive', 'v3', credentials=get_creds())
+        _thread_local.drive_service = service
+    return service
+
+def get_sheets_service():
+    """スレッドごとに1つの Sheets サービスを生成して使い回す"""
+    service = getattr(_thread_local, "sheets_service", None)
+    if service is None:
+        service = build('sheets', 'v4', credentials=get_creds())
+        _thread_local.sheets_service = service
+    return service
+
+class TokenBucket:
+    """
+    スレッド間で共有するトークンバケット方式のレートリミッタ
+    rate: 1秒あたりに補充されるトークン数、capacity: バースト時に使えるトークン数の上限
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, capacity=DEFAULT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
 
-def get_file_content(file_id, mimeType):
-    content = ""
+rate_limiter = TokenBucket()
+
+def is_rate_limit_error(e):
+    """429 または 403 rateLimitExceeded / userRateLimitExceeded かどうかを判定する"""
+    status = getattr(getattr(e, "resp", None), "status", None)
+    if status == 429:
+        return True
+    if status != 403:
+        return False
     try:
-        if mimeType == "application/vnd.google-apps.document":
-            print(f"Document {file_id} をテキスト形式でエクスポート中...")
-            request = drive_service.files().export_media(fileId=file_id, mimeType="text/plain")
-            fh = BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-                print(f"Downloading {file_id}: {int(status.progress() * 100)}%")
-            content = fh.getvalue().decode("utf-8")
-        elif mimeType == "application/vnd.google-apps.spreadsheet":
-            print(f"Spreadsheet {file_id} の全シートのデータを取得中...")
-            sheets_service = build('sheets', 'v4', credentials=creds)
-            spreadsheet = sheets_service.spreadsheets().get(
-                spreadsheetId=file_id,
-                includeGridData=True
-            ).execute()
-            all_sheet_texts = []
-            for sheet in spreadsheet.get('sheets', []):
-                sheet_title = sheet.get('properties', {}).get('title', 'Sheet')
-                sheet_text = f"シート: {sheet_title}\n"
-                grid_data = sheet.get('data', [])
-                for grid in grid_data:
-                    row_data = grid.get('rowData', [])
-                    for row in row_data:
-                        cell_values = []
-                        for cell in row.get('values', []):
-                            cell_text = cell.get('formattedValue', '')
-                            cell_values.append(cell_text)
-                        sheet_text += "\t".join(cell_values) + "\n"
-                all_sheet_texts.append(sheet_text)
-            content = "\n".join(all_sheet_texts)
-        elif mimeType == "application/vnd.google-apps.presentation":
-            print(f"Presentation {file_id} を PDF 形式でエクスポート中...")
-            request = drive_service.files().export_media(fileId=file_id, mimeType="application/pdf")
-            fh = BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-                print(f"Downloading {file_id}: {int(status.progress() * 100)}%")
-            import PyPDF2
-            fh.seek(0)
-            reader = PyPDF2.PdfReader(fh)
-            texts = []
-            for page in reader.pages:
-                texts.append(page.extract_text())
-            content = "\n".join(texts)
-        elif mimeType == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            print(f"DOCX {file_id} をダウンロード中...")
-            request = drive_service.files().get_media(fileId=file_id)
-            fh = BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-                print(f"Downloading {file_id}: {int(status.progress() * 100)}%")
-            from docx import Document
-            fh.seek(0)
-            document = Document(fh)
-            content = "\n".join([para.text for para in document.paragraphs])
-        elif mimeType == "application/vnd.openxmlformats-officedocument.presentationml.presentation":
-            print(f"PPTX {file_id} をダウンロード中...")
-            request = drive_service.files().get_media(fileId=file_id)
-            fh = BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-                print(f"Downloading {file_id}: {int(status.progress() * 100)}%")
-            from pptx import Presentation
-            fh.seek(0)
-            prs = Presentation(fh)
-            texts = []
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        texts.append(shape.text)
-            content = "\n".join(texts)
-        elif mimeType == "application/pdf":
-            print(f"PDF {file_id} をダウンロード中...")
-            request = drive_service.files().get_media(fileId=file_id)
-            fh = BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-                print(f"Downloading {file_id}: {int(status.progress() * 100)}%")
-            import PyPDF2
-            fh.seek(0)
-            reader = PyPDF2.PdfReader(fh)
-            texts = []
-            for page in reader.pages:
-                texts.append(page.extract_text())
-            content = "\n".join(texts)
-        elif mimeType == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
-            print(f"XLSX {file_id} をダウンロード中...")
-            request = drive_service.files().get_media(fileId=file_id)
-            fh = BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-                print(f"Downloading {file_id}: {int(status.progress() * 100)}%")
-            from openpyxl import load_workbook
-            fh.seek(0)
-            wb = load_workbook(fh, read_only=True, data_only=True)
-            sheet_texts = []
-            for ws in wb.worksheets:
-                sheet_text = f"シート: {ws.title}\n"
-                for row in ws.iter_rows(values_only=True):
-                    row_str = "\t".join([str(cell) if cell is not None else "" for cell in row])
-                    sheet_text += row_str + "\n"
-                sheet_texts.append(sheet_text)
-            content = "\n".join(sheet_texts)
+        content = e.content.decode("utf-8") if isinstance(e.content, bytes) else e.content
+        errors = json.loads(content).get("error", {}).get("errors", [])
+    except Exception:
+        return False
+    return any(err.get("reason") in RATE_LIMIT_REASONS for err in errors)
+
+def call_with_retry(func, limiter=None, max_retries=MAX_RETRIES):
+    """
+    レートリミッタでトークンを取得してから func() を実行する。
+    クォータ超過（429 / 403 rateLimitExceeded）の場合は指数バックオフ（ジッター付き）で再試行する。
+    """
+    limiter = limiter or rate_limiter
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= max_retries or not is_rate_limit_error(e):
+                raise
+            wait = min(64, 2 ** attempt) + random.random()
+            print(f"レート制限のため {wait:.1f} 秒待機して再試行します ({attempt + 1}/{max_retries})")
+            time.sleep(wait)
+
+def execute(request, limiter=None):
+    """API リクエストをレート制限・再試行付きで実行する"""
+    return call_with_retry(request.execute, limiter)
+
+class SpoolBuffer:
+    """
+    ダウンロード先のバッファ。spool_threshold バイトまではメモリに置き、超えた時点で一時ファイルに書き出す。
+    payload() はメモリ上ならバイト列、一時ファイルならそのパスを返す（パスは呼び出し側で削除する）
+    """
+
+    def __init__(self, spool_threshold=DEFAULT_SPOOL_THRESHOLD):
+        self.spool_threshold = spool_threshold
+        self.buffer = BytesIO()
+        self.file = None
+        self.size = 0
+        self.truncated = False
+
+    def write(self, data):
+        if self.file is None and self.size + len(data) > self.spool_threshold:
+            self.file = tempfile.NamedTemporaryFile(prefix="drive_", suffix=".download", delete=False)
+            self.file.write(self.buffer.getvalue())
+            self.buffer = None
+        (self.file or self.buffer).write(data)
+        self.size += len(data)
+        return len(data)
+
+    def payload(self):
+        if self.file is None:
+            return self.buffer.getvalue()
+        self.file.close()
+        return self.file.name
+
+    def discard(self):
+        """ダウンロードに失敗したときに一時ファイルを閉じて削除する"""
+        if self.file is not None:
+            self.file.close()
+            if os.path.exists(self.file.name):
+                os.remove(self.file.name)
+
+def download(request, limiter=None, chunk_size=DEFAULT_CHUNK_SIZE, spool_threshold=DEFAULT_SPOOL_THRESHOLD,
+             max_bytes=None):
+    """
+    メディアのダウンロードを chunk_size 単位でレート制限・再試行付きで行い、SpoolBuffer を返す。
+    max_bytes を超えた時点でダウンロードを打ち切り、truncated を立てる。
+    """
+    fh = SpoolBuffer(spool_threshold)
+    downloader = MediaIoBaseDownload(fh, request, chunksize=chunk_size)
+    done = False
+    try:
+        while not done:
+            status, done = call_with_retry(downloader.next_chunk, limiter)
+            if max_bytes and fh.size > max_bytes and not done:
+                fh.truncated = True
+                break
+    except BaseException:
+        fh.discard()
+        raise
+    return fh
+
+def remove_payload(kind, payload):
+    """一時ファイルに書き出したダウンロード結果を削除する"""
+    if kind not in (None, "text") and isinstance(payload, str) and os.path.exists(payload):
+        os.remove(payload)
+
+# --- CPU 負荷の高い解析処理（プロセスプールで実行できるよう、バイト列または一時ファイルのパスを受け取るトップレベル関数にしている） ---
+# ページ・スライド・行を1つずつ読み進めて抽出し、抽出済みのものを保持し続けないようにする
+def _open_source(source):
+    return BytesIO(source) if isinstance(source, bytes) else open(source, "rb")
+
+def extract_pdf(source, max_pages=None, max_rows=None):
+    import PyPDF2
+    texts = []
+    with _open_source(source) as fh:
+        reader = PyPDF2.PdfReader(fh)
+        for i, page in enumerate(reader.pages):
+            if max_pages and i >= max_pages:
+                texts.append(f"（{max_pages} ページ以降は省略）")
+                break
+            texts.append(page.extract_text())
+    return "\n".join(texts)
+
+def extract_docx(source, max_pages=None, max_rows=None):
+    from docx import Document
+    with _open_source(source) as fh:
+        document = Document(fh)
+    return "\n".join([para.text for para in document.paragraphs])
+
+def extract_pptx(source, max_pages=None, max_rows=None):
+    from pptx import Presentation
+    texts = []
+    with _open_source(source) as fh:
+        prs = Presentation(fh)
+        for i, slide in enumerate(prs.slides):
+            if max_pages and i >= max_pages:
+                texts.append(f"（{max_pages} スライド以降は省略）")
+                break
+            for shape in slide.shapes:
+                if hasattr(shape, "text"):
+                    texts.append(shape.text)
+    return "\n".join(texts)
+
+def extract_xlsx(source, max_pages=None, max_rows=None):
+    from openpyxl import load_workbook
+    sheet_texts = []
+    with _open_source(source) as fh:
+        wb = load_workbook(fh, read_only=True, data_only=True)
+        for ws in wb.worksheets:
+            lines = [f"シート: {ws.title}"]
+            for i, row in enumerate(ws.iter_rows(values_only=True)):
+                if max_rows and i >= max_rows:
+                    lines.append(f"（{max_rows} 行以降は省略）")
+                    break
+                lines.append("\t".join([str(cell) if cell is not None else "" for cell in row]))
+            sheet_texts.append("\n".join(lines) + "\n")
+        wb.close()
+    return "\n".join(sheet_texts)
+
+EXTRACTORS = {
+    "pdf": extract_pdf,
+    "docx": extract_docx,
+    "pptx": extract_pptx,
+    "xlsx": extract_xlsx,
+}
+
+def extract_text(kind, source, max_pages=DEFAULT_MAX_PAGES, max_rows=DEFAULT_MAX_ROWS):
+    """ダウンロード済みのバイト列（または一時ファイルのパス）を種類ごとの抽出関数でテキストに変換する"""
+    return EXTRACTORS[kind](source, max_pages, max_rows)
+
+class ParseTimeoutError(Exception):
+    pass
+
+def _parse_worker_loop(conn):
+    """解析用プロセスの本体。(種類, データ, max_pages, max_rows) を受け取り、(成否, テキストまたはエラー) を返す"""
+    conn.send("ready")
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        kind, source, max_pages, max_rows = job
+        try:
+            result = (True, extract_text(kind, source, max_pages, max_rows))
+        except Exception as e:
+            result = (False, f"{type(e).__name__}: {e}")
+        conn.send(result)
+
+class ParseWorker:
+    """解析用の常駐プロセス1つ（パイプで1件ずつ解析を依頼する）"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_parse_worker_loop, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        # 起動（spawn によるモジュールの読み込み）の時間を解析のタイムアウトに含めないよう、準備完了を待つ
+        self.conn.recv()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.kill()
         else:
-            print(f"ファイル {file_id} は対応していない MIMEタイプ: {mimeType}")
+            self.conn.close()
+
+class ParsePool:
+    """
+    PDF・Office ファイルの解析を行うプロセスのプール。空いているプロセスに1件ずつ渡し、
+    timeout 秒（解析を渡した時点から数える）で終わらなければそのプロセスを強制終了して作り直す。
+    プロセスは最初に使うときに起動し、空きがないときは run() の呼び出し側が待たされる。
+    """
+
+    def __init__(self, workers):
+        # I/O スレッドが動いている状態で fork しないよう spawn で起動する
+        self.context = multiprocessing.get_context("spawn")
+        self.idle = queue.Queue()
+        for _ in range(workers):
+            self.idle.put(None)
+
+    def run(self, kind, payload, max_pages, max_rows, timeout):
+        worker = self.idle.get()
+        try:
+            if worker is None:
+                worker = ParseWorker(self.context)
+            worker.conn.send((kind, payload, max_pages, max_rows))
+            if not worker.conn.poll(timeout):
+                worker.kill()
+                worker = None
+                raise ParseTimeoutError()
+            try:
+                ok, result = worker.conn.recv()
+            except EOFError:
+                worker.kill()
+                exitcode, worker = worker.process.exitcode, None
+                raise RuntimeError(f"解析プロセスが異常終了しました（終了コード {exitcode}）")
+        finally:
+            self.idle.put(worker)
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def close(self):
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not None:
+                worker.stop()
+
+def fetch_sheet_values(file_id, sheets_service, limiter=None, max_rows=None):
+    """
+    スプレッドシートの全シートを値のみで取得してテキストにする。
+    シート名だけを絞り込んだフィールドマスクで取得し、全シートの値を values.batchGet 1回でまとめて読む
+    （書式などのセルのメタデータは取得しない）。values.batchGet は値のある範囲しか返さないので、
+    includeGridData で取得していたときと比べて、データ範囲より後ろの空行・空列は出力されない。
+    """
+    spreadsheet = execute(sheets_service.spreadsheets().get(
+        spreadsheetId=file_id,
+        fields="sheets.properties.title"
+    ), limiter)
+    titles = [sheet.get('properties', {}).get('title', 'Sheet') for sheet in spreadsheet.get('sheets', [])]
+    if not titles:
+        return ""
+    ranges = ["'" + title.replace("'", "''") + "'" for title in titles]
+    response = execute(sheets_service.spreadsheets().values().batchGet(
+        spreadsheetId=file_id,
+        ranges=ranges,
+        valueRenderOption="FORMATTED_VALUE",
+        majorDimension="ROWS"
+    ), limiter)
+    all_sheet_texts = []
+    for title, value_range in zip(titles, response.get('valueRanges', [])):
+        rows = value_range.get('values', [])
+        # values.batchGet は各行の末尾の空セルを返さないため、データのある範囲の列数までタブ区切りを埋める
+        width = max((len(row) for row in rows), default=0)
+        lines = [f"シート: {title}"]
+        for i, row in enumerate(rows):
+            if max_rows and i >= max_rows:
+                lines.append(f"（{max_rows} 行以降は省略）")
+                break
+            lines.append("\t".join([str(cell) for cell in row] + [""] * (width - len(row))))
+        all_sheet_texts.append("\n".join(lines) + "\n")
+    return "\n".join(all_sheet_texts)
+
+def _binary_payload(file_id, fh):
+    payload = fh.payload()
+    if fh.truncated:
+        # 途中で切ったバイナリは解析できないので捨てる
+        remove_payload("binary", payload)
+        raise ValueError(f"ファイル {file_id} はサイズ上限を超えたためスキップします")
+    return payload
+
+def fetch_file_payload(file_id, mimeType, service=None, limiter=None, max_rows=None, download_options=None):
+    """
+    ファイル内容を取得する（I/O のみ）。戻り値は (種類, データ)
+    - ("text", str): API 側でテキスト化できるもの（ドキュメント・スプレッドシート）
+    - ("pdf" / "docx" / "pptx" / "xlsx", bytes または一時ファイルのパス): 解析が必要なもの
+    - (None, None): 対応していない MIMEタイプ
+    download_options は download() に渡すチャンクサイズ・スプールのしきい値・最大バイト数
+    """
+    service = service or get_drive_service()
+    download_options = download_options or {}
+    if mimeType == "application/vnd.google-apps.document":
+        print(f"Document {file_id} をテキスト形式でエクスポート中...")
+        request = service.files().export_media(fileId=file_id, mimeType="text/plain")
+        fh = download(request, limiter, **download_options)
+        payload = fh.payload()
+        if not isinstance(payload, bytes):
+            try:
+                with open(payload, "rb") as f:
+                    data = f.read(download_options.get("max_bytes") or -1)
+            finally:
+                os.remove(payload)
+            payload = data
+        if fh.truncated:
+            print(f"Document {file_id} はサイズ上限を超えたため途中までを使用します")
+        return "text", payload.decode("utf-8", errors="ignore")
+    elif mimeType == "application/vnd.google-apps.spreadsheet":
+        print(f"Spreadsheet {file_id} の全シートのデータを取得中...")
+        return "text", fetch_sheet_values(file_id, get_sheets_service(), limiter, max_rows)
+    elif mimeType == "application/vnd.google-apps.presentation":
+        print(f"Presentation {file_id} を PDF 形式でエクスポート中...")
+        request = service.files().export_media(fileId=file_id, mimeType="application/pdf")
+        return "pdf", _binary_payload(file_id, download(request, limiter, **download_options))
+    elif mimeType in DOWNLOAD_KINDS:
+        kind = DOWNLOAD_KINDS[mimeType]
+        print(f"{kind.upper()} {file_id} をダウンロード中...")
+        request = service.files().get_media(fileId=file_id)
+        return kind, _binary_payload(file_id, download(request, limiter, **download_options))
+    else:
+        print(f"ファイル {file_id} は対応していない MIMEタイプ: {mimeType}")
+        return None, None
+
+def fetch_file_content(file_id, mimeType, service=None, limiter=None):
+    """ファイル内容をテキストで取得する（同じスレッドで解析まで行う。失敗時は例外を送出する）"""
+    kind, payload = fetch_file_payload(file_id, mimeType, service, limiter, DEFAULT_MAX_ROWS,
+                                       {"max_bytes": DEFAULT_MAX_FILE_SIZE})
+    if kind is None:
+        return ""
+    if kind == "text":
+        return payload
+    try:
+        return extract_text(kind, payload)
+    finally:
+        remove_payload(kind, payload)
+
+def get_file_content(file_id, mimeType, service=None, limiter=None):
+    try:
+        return fetch_file_content(file_id, mimeType, service, limiter)
     except Exception as e:
         print(f"ファイル {file_id} のコンテンツ取得に失敗: {e}")
-    return content
+        return ""
 
-def list_files_recursive(folder_id, files_data=None):
-    if files_data is None:
-        files_data = []
+class ContentCache:
+    """
+    抽出済みテキストのローカルキャッシュ。(ファイルID, modifiedTime) をキーとし、
+    更新されていないファイルは再ダウンロード・再解析せずに再利用する。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, file_id):
+        return os.path.join(self.cache_dir, f"{file_id}.json")
+
+    def get(self, file_id, modified_time):
+        path = self._path(file_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except Exception:
+            return None
+        if entry.get("modifiedTime") != modified_time:
+            return None
+        return entry.get("content")
+
+    def put(self, file_id, modified_time, content):
+        path = self._path(file_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"modifiedTime": modified_time, "content": content}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def remove(self, file_id):
+        path = self._path(file_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+class ContentDownloader:
+    """
+    ファイル内容の取得（エクスポート・ダウンロード・解析）を並列に行うプール。
+    ワーカー数と処理待ちの件数に上限を設け、全ワーカーでレートリミッタを共有する。
+    service_factory を差し替えると偽の Drive サービスでテストできる。
+    cache を指定すると modifiedTime が変わっていないファイルはキャッシュから返す。
+    writer（JsonlWriter）を指定すると、取得が終わったドキュメントから順に書き出して手元には保持しない。
+    その場合、書き込み済みの ID は取得自体をスキップする（再開用）。取得に失敗したものは書き出さないので、
+    再開時に取り直される（件数は failed に数える）。
+    parse_workers を指定すると、PDF・DOCX・PPTX・XLSX の解析（CPU 処理）を I/O ワーカーから切り離して
+    ParsePool のプロセスで実行する。空いている解析プロセスがなければ I/O ワーカーが待たされる（バックプレッシャー）。
+    解析を始めてから parse_timeout 秒で終わらないものはプロセスごと止めて失敗として扱う。
+    ダウンロードは chunk_size 単位で行い、spool_threshold を超えた分は一時ファイルに書き出す。
+    メタデータの size が max_file_size を超えるファイルは取得せず空として扱う（エクスポートは size がないため、
+    ダウンロード中に max_file_size を超えた時点で打ち切る）。
+    """
+
+    def __init__(self, workers=4, limiter=None, service_factory=None, max_pending=None, cache=None, writer=None,
+                 parse_workers=0, parse_timeout=DEFAULT_PARSE_TIMEOUT,
+                 max_pages=DEFAULT_MAX_PAGES, max_rows=DEFAULT_MAX_ROWS, max_file_size=DEFAULT_MAX_FILE_SIZE,
+                 chunk_size=DEFAULT_CHUNK_SIZE, spool_threshold=DEFAULT_SPOOL_THRESHOLD):
+        self.cache = cache
+        self.writer = writer
+        self.streaming = writer is not None
+        self.limiter = limiter or rate_limiter
+        self.service_factory = service_factory or get_drive_service
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(max_pending or workers * 4)
+        self.jobs = []
+        self.failed = 0
+        self.failed_lock = threading.Lock()
+        self.parse_timeout = parse_timeout
+        self.max_pages = max_pages
+        self.max_rows = max_rows
+        self.max_file_size = max_file_size
+        self.download_options = {"chunk_size": chunk_size, "spool_threshold": spool_threshold,
+                                 "max_bytes": max_file_size}
+        self.parser = None
+        if parse_workers:
+            self.parser = ParsePool(parse_workers)
+
+    def _fetch(self, file_info, mime_type, size):
+        try:
+            content = self._fetch_content(file_info, mime_type, size)
+            if self.streaming:
+                # 取得に失敗したものは書き出さず、--resume で再実行したときに取り直す
+                if content is None:
+                    with self.failed_lock:
+                        self.failed += 1
+                else:
+                    self.writer.write(dict(file_info, content=content))
+                return None
+            return content or ""
+        finally:
+            self.slots.release()
+
+    def _fetch_content(self, file_info, mime_type, size=None):
+        """ファイルのテキストを返す（取得・解析に失敗した場合やサイズ上限でスキップした場合は None）"""
+        file_id = file_info["id"]
+        if self.cache:
+            cached = self.cache.get(file_id, file_info.get("modifiedTime"))
+            if cached is not None:
+                return cached
+        if self.max_file_size and size and int(size) > self.max_file_size:
+            # 上限を変えて再実行したときに取得できるよう、キャッシュはしない
+            print(f"ファイル {file_id} は {int(size)} バイトで上限を超えるためスキップします")
+            return None
+        kind, payload = None, None
+        try:
+            kind, payload = fetch_file_payload(file_id, mime_type, self.service_factory(), self.limiter,
+                                               self.max_rows, self.download_options)
+            if kind is None:
+                content = ""
+            elif kind == "text":
+                content = payload
+            else:
+                content = self._parse(kind, payload)
+        except ParseTimeoutError:
+            print(f"ファイル {file_id} の解析が {self.parse_timeout} 秒以内に終わらなかったためスキップします")
+            return None
+        except Exception as e:
+            print(f"ファイル {file_id} のコンテンツ取得に失敗: {e}")
+            return None
+        finally:
+            remove_payload(kind, payload)
+        # 取得に成功したものだけをキャッシュする（失敗したものは次回再取得する）
+        if self.cache:
+            self.cache.put(file_id, file_info.get("modifiedTime"), content)
+        return content
+
+    def _parse(self, kind, payload):
+        if self.parser is None:
+            return extract_text(kind, payload, self.max_pages, self.max_rows)
+        return self.parser.run(kind, payload, self.max_pages, self.max_rows, self.parse_timeout)
+
+    def submit(self, file_info, mime_type, size=None):
+        """
+        file_info["content"] の取得を予約する（処理待ちが上限に達している場合は空くまで待つ）。
+        size は Drive のメタデータのファイルサイズ（Google ドキュメント形式など、ないものは None）
+        """
+        if self.streaming and file_info["id"] in self.writer:
+            return
+        self.slots.acquire()
+        future = self.executor.submit(self._fetch, file_info, mime_type, size)
+        if not self.streaming:
+            self.jobs.append((file_info, future))
+
+    def collect(self):
+        """全ジョブの完了を待ち、content を埋めた file_info を予約順に返す（writer 指定時は空リスト）"""
+        results = []
+        for file_info, future in self.jobs:
+            file_info["content"] = future.result()
+            results.append(file_info)
+        self.jobs = []
+        self.executor.shutdown()
+        if self.parser:
+            self.parser.close()
+        return results
+
+def fetch_permissions_batch(file_ids, service=None, limiter=None):
+    """
+    permissions().list を最大 BATCH_LIMIT 件ずつバッチHTTPリクエストにまとめて取得し、
+    {file_id: permissions} を返す。レート制限で失敗したものはバックオフ後にまとめて再送する。
+    """
+    service = service or get_drive_service()
+    limiter = limiter or rate_limiter
+    results = {}
+    pending = list(file_ids)
+    attempt = 0
+    while pending:
+        retry = []
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                results[request_id] = response.get("permissions", [])
+            elif attempt < MAX_RETRIES and is_rate_limit_error(exception):
+                retry.append(request_id)
+            else:
+                print(f"ファイル {request_id} のアクセス権取得に失敗: {exception}")
+                results[request_id] = []
+
+        for i in range(0, len(pending), BATCH_LIMIT):
+            chunk = pending[i:i + BATCH_LIMIT]
+            batch = service.new_batch_http_request(callback=callback)
+            for file_id in chunk:
+                batch.add(service.permissions().list(fileId=file_id, fields=PERMISSION_FIELDS),
+                          request_id=file_id)
+            # バッチ内の各リクエストもクォータを消費する
+            for _ in chunk:
+                limiter.acquire()
+            try:
+                batch.execute()
+            except Exception as e:
+                if attempt < MAX_RETRIES and is_rate_limit_error(e):
+                    retry.extend(chunk)
+                    continue
+                print(f"アクセス権のバッチ取得に失敗: {e}")
+                for file_id in chunk:
+                    results.setdefault(file_id, [])
+
+        pending = retry
+        if pending:
+            wait = min(64, 2 ** attempt) + random.random()
+            print(f"レート制限のため {wait:.1f} 秒待機して {len(pending)} 件のアクセス権取得を再試行します")
+            time.sleep(wait)
+            attempt += 1
+    return results
+
+def build_file_info(file, permissions):
+    """
+    ファイルのメタデータとアクセス権から出力用の情報を組み立てる。
+    ドメイン共有されていないファイルは None を返す（内容取得の対象外）。
+    """
+    has_domain_permission = any(perm.get("type") == "domain" and perm.get("domain", "") == DOMAIN
+                                for perm in permissions)
+    if not has_domain_permission:
+        return None
+    collaborators = []
+    for perm in permissions:
+        if perm.get("type") == "user" and perm.get("role") in ["writer", "commenter"]:
+            collaborators.append({
+                "id": perm.get("id"),
+                "displayName": perm.get("displayName"),
+                "emailAddress": perm.get("emailAddress"),
+                "role": perm.get("role")
+            })
+    return {
+        "id": file.get("id"),
+        "title": file.get("name"),
+        "url": file.get("webViewLink") if file.get("webViewLink") else "",
+        "createdTime": file.get("createdTime"),
+        "modifiedTime": file.get("modifiedTime"),
+        "owners": file.get("owners"),
+        "collaborators": collaborators,
+        "content": None
+    }
+
+def list_folder(folder_id, service=None, limiter=None):
+    """フォルダ直下のファイル・フォルダを全ページ分取得する"""
+    service = service or get_drive_service()
+    files = []
     page_token = None
     query = f"'{folder_id}' in parents"
     while True:
         try:
-            response = drive_service.files().list(
+            response = execute(service.files().list(
                 q=query,
-                fields="nextPageToken, files(id, name, mimeType, webViewLink, createdTime, modifiedTime, owners)",
+                fields=f"nextPageToken, files(id, name, mimeType, size, webViewLink, createdTime, modifiedTime, owners, {PERMISSION_FIELDS})",
                 pageToken=page_token,
                 pageSize=1000
-            ).execute()
+            ), limiter)
         except Exception as e:
             print(f"フォルダ {folder_id} のファイルリスト取得に失敗: {e}")
             break
+        files.extend(response.get('files', []))
+        page_token = response.get("nextPageToken", None)
+        if not page_token:
+            break
+    return files
 
-        for file in response.get('files', []):
-            if file.get("mimeType") == "application/vnd.google-apps.folder":
-                try:
-                    list_files_recursive(file.get("id"), files_data)
-                except Exception as e:
-                    print(f"フォルダ {file.get('id')} の処理中にエラー: {e}")
-            else:
+def list_files_in_tree(folder_id, files_data=None, service=None, downloader=None, limiter=None, tree=None,
+                       list_workers=DEFAULT_LIST_WORKERS, service_factory=None):
+    """
+    フォルダ以下のファイルを幅優先で列挙する。
+    再帰ではなくワークキューで走査し、list_workers 件のフォルダの一覧取得を並行して行う。
+    複数の親フォルダから共有されているフォルダ・ファイルは訪問済み集合により一度だけ処理する。
+    downloader を指定した場合、各ファイルの内容取得はプールに予約され、
+    downloader.collect() の時点で content が埋まる。
+    tree を指定した場合、見つかったフォルダ・ファイルの親フォルダと MIMEタイプを記録する（差分同期用）
+    """
+    if files_data is None:
+        files_data = []
+    service_factory = service_factory or get_drive_service
+    service = service or service_factory()
+    visited_folders = {folder_id}
+    seen_files = set()
+    stats = {"folders_listed": 0, "folders_found": 1, "files_found": 0, "files_matched": 0}
+
+    def list_in_worker(fid):
+        return list_folder(fid, service_factory(), limiter)
+
+    with ThreadPoolExecutor(max_workers=list_workers) as executor:
+        in_flight = {executor.submit(list_in_worker, folder_id): folder_id}
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                parent_id = in_flight.pop(future)
+                stats["folders_listed"] += 1
                 try:
-                    perms = drive_service.permissions().list(
-                        fileId=file.get("id"),
-                        fields="permissions(id, type, role, emailAddress, displayName, domain)"
-                    ).execute()
+                    files = future.result()
                 except Exception as e:
-                    print(f"ファイル {file.get('id')} のアクセス権取得に失敗: {e}")
-                    perms = {"permissions": []}
-
-                has_domain_permission = any(perm.get("type") == "domain" and perm.get("domain", "") == "techfund.jp"
-                                            for perm in perms.get("permissions", []))
-                if has_domain_permission:
-                    collaborators = []
-                    for perm in perms.get("permissions", []):
-                        if perm.get("type") == "user" and perm.get("role") in ["writer", "commenter"]:
-                            collaborators.append({
-                                "id": perm.get("id"),
-                                "displayName": perm.get("displayName"),
-                                "emailAddress": perm.get("emailAddress"),
-                                "role": perm.get("role")
-                            })
-                    file_info = {
-                        "id": file.get("id"),
-                        "title": file.get("name"),
-                        "url": file.get("webViewLink") if file.get("webViewLink") else "",
-                        "createdTime": file.get("createdTime"),
-                        "modifiedTime": file.get("modifiedTime"),
-                        "owners": file.get("owners"),
-                        "collaborators": collaborators,
-                        "content": get_file_content(file.get("id"), file.get("mimeType"))
-                    }
+                    print(f"フォルダ {parent_id} の処理中にエラー: {e}")
+                    continue
+
+                # files.list のフィールドマスクで取得できなかったアクセス権（共有ドライブ上のファイル等）だけをバッチで取得する
+                missing = [f.get("id") for f in files
+                           if f.get("mimeType") != FOLDER_MIME and "permissions" not in f
+                           and f.get("id") not in seen_files]
+                batch_perms = fetch_permissions_batch(missing, service, limiter) if missing else {}
+
+                for file in files:
+                    file_id = file.get("id")
+                    if file.get("mimeType") == FOLDER_MIME:
+                        if tree is not None:
+                            parents = tree["folders"].setdefault(file_id, [])
+                            if parent_id not in parents:
+                                parents.append(parent_id)
+                        if file_id not in visited_folders:
+                            visited_folders.add(file_id)
+                            stats["folders_found"] += 1
+                            in_flight[executor.submit(list_in_worker, file_id)] = file_id
+                        continue
+
+                    if file_id in seen_files:
+                        if tree is not None and file_id in tree["files"]:
+                            tree["files"][file_id]["parents"].append(parent_id)
+                        continue
+                    seen_files.add(file_id)
+                    stats["files_found"] += 1
+                    permissions = file.get("permissions")
+                    if permissions is None:
+                        permissions = batch_perms.get(file_id, [])
+
+                    # ドメイン共有されていないファイルは内容取得を予約する前に除外する
+                    file_info = build_file_info(file, permissions)
+                    if not file_info:
+                        continue
+                    stats["files_matched"] += 1
+                    if tree is not None:
+                        tree["files"][file_id] = {"parents": [parent_id], "mimeType": file.get("mimeType"),
+                                                  "size": file.get("size")}
+                    if downloader:
+                        downloader.submit(file_info, file.get("mimeType"), file.get("size"))
+                        if downloader.streaming:
+                            continue
+                    else:
+                        file_info["content"] = get_file_content(file_id, file.get("mimeType"), service, limiter)
                     files_data.append(file_info)
-        page_token = response.get("nextPageToken", None)
-        if not page_token:
-            break
+
+                print(f"走査済みフォルダ {stats['folders_listed']}/{stats['folders_found']} / "
+                      f"検出ファイル {stats['files_found']} / 取得対象 {stats['files_matched']}")
     return files_data
 
+def load_sync_state(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_sync_state(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def list_changes(page_token, service=None, limiter=None):
+    """page_token 以降の変更を全件取得し、(変更リスト, 次回用の startPageToken) を返す"""
+    service = service or get_drive_service()
+    changes = []
+    while True:
+        response = execute(service.changes().list(
+            pageToken=page_token,
+            fields=CHANGE_FIELDS,
+            includeRemoved=True,
+            spaces="drive",
+            pageSize=1000
+        ), limiter)
+        changes.extend(response.get("changes", []))
+        if "newStartPageToken" in response:
+            return changes, response["newStartPageToken"]
+        page_token = response["nextPageToken"]
+
+def _is_alive(change):
+    file = change.get("file") or {}
+    return not change.get("removed") and not file.get("trashed")
+
+def full_sync(folder_id, service, downloader, limiter=None, list_workers=DEFAULT_LIST_WORKERS):
+    """初回同期: 変更取得の起点となる startPageToken を記録してから全件をクロールする"""
+    start_page_token = execute(service.changes().getStartPageToken(), limiter)["startPageToken"]
+    tree = {"folders": {folder_id: []}, "files": {}}
+    list_files_in_tree(folder_id, [], service, downloader, limiter, tree, list_workers)
+    state = {"folder_id": folder_id, "startPageToken": start_page_token,
+             "folders": tree["folders"], "files": tree["files"]}
+    return state, set(tree["files"]), set()
+
+def incremental_sync(state, service, downloader, limiter=None, list_workers=DEFAULT_LIST_WORKERS):
+    """
+    前回の startPageToken 以降の変更だけを取得して state を更新する。
+    戻り値: (更新されたファイルIDの集合, 削除・ゴミ箱移動・対象外になったファイルIDの集合)
+    """
+    root_id = state["folder_id"]
+    folders = state["folders"]
+    files = state["files"]
+    changes, new_page_token = list_changes(state["startPageToken"], service, limiter)
+    print(f"変更件数: {len(changes)}")
+
+    # 同じファイルへの複数の変更は最新のものだけを見る
+    latest = {}
+    for change in changes:
+        latest[change["fileId"]] = change
+
+    def in_tree(parents):
+        return any(p in folders for p in parents or [])
+
+    # フォルダの追加・移動・削除を反映する（親が後から追加される場合に備えて収束するまで繰り返す）
+    folder_changes = [c for c in latest.values()
+                      if (c.get("file") or {}).get("mimeType") == FOLDER_MIME or c["fileId"] in folders]
+    new_folders = []
+    updated_folder = True
+    while updated_folder:
+        updated_folder = False
+        for change in folder_changes:
+            fid = change["fileId"]
+            if fid == root_id:
+                continue
+            file = change.get("file") or {}
+            if _is_alive(change) and in_tree(file.get("parents")):
+                if fid not in folders:
+                    new_folders.append(fid)
+                    updated_folder = True
+                folders[fid] = file.get("parents")
+            elif fid in folders:
+                del folders[fid]
+                updated_folder = True
+    # 親フォルダがツリーから外れたフォルダを取り除く
+    pruned = True
+    while pruned:
+        pruned = False
+        for fid, parents in list(folders.items()):
+            if fid != root_id and not in_tree(parents):
+                del folders[fid]
+                pruned = True
+
+    removed = set()
+    for fid, entry in list(files.items()):
+        if not in_tree(entry["parents"]):
+            del files[fid]
+            removed.add(fid)
+
+    # 新しく追加（移動）されたフォルダは既存の中身ごとクロールする
+    updated = set()
+    new_folder_set = {f for f in new_folders if f in folders}
+    for fid in new_folder_set:
+        if any(p in new_folder_set for p in folders[fid]):
+            continue
+        tree = {"folders": {}, "files": {}}
+        list_files_in_tree(fid, [], service, downloader, limiter, tree, list_workers)
+        folders.update(tree["folders"])
+        files.update(tree["files"])
+        updated |= set(tree["files"])
+
+    # ファイルの追加・更新・削除を反映する
+    candidates = []
+    for change in latest.values():
+        fid = change["fileId"]
+        file = change.get("file") or {}
+        if fid in folders or file.get("mimeType") == FOLDER_MIME or fid in updated:
+            continue
+        if not _is_alive(change) or not in_tree(file.get("parents")):
+            if fid in files:
+                del files[fid]
+                removed.add(fid)
+            continue
+        candidates.append(file)
+    missing = [f["id"] for f in candidates if "permissions" not in f]
+    batch_perms = fetch_permissions_batch(missing, service, limiter) if missing else {}
+    for file in candidates:
+        fid = file["id"]
+        permissions = file.get("permissions")
+        if permissions is None:
+            permissions = batch_perms.get(fid, [])
+        file_info = build_file_info(file, permissions)
+        if file_info is None:
+            if fid in files:
+                del files[fid]
+                removed.add(fid)
+            continue
+        files[fid] = {"parents": file.get("parents"), "mimeType": file.get("mimeType"), "size": file.get("size"),
+                      "info": file_info}
+        downloader.submit(file_info, file.get("mimeType"), file.get("size"))
+        updated.add(fid)
+
+    state["startPageToken"] = new_page_token
+    return updated, removed
+
+def sync(args, limiter, pipeline=None):
+    """
+    Changes API による差分同期。前回の同期状態（startPageToken とフォルダツリー）から
+    変更されたファイルだけを取得し、内容は (ファイルID, modifiedTime) キーのキャッシュから再利用する。
+    """
+    service = get_drive_service()
+    cache = ContentCache(args.cache_dir)
+    downloader = ContentDownloader(workers=args.workers, limiter=limiter, cache=cache, **(pipeline or {}))
+    state = load_sync_state(args.state)
+    if state is None or state.get("folder_id") != args.folder_id:
+        print("同期状態がないため全件を取得します")
+        state, updated, removed = full_sync(args.folder_id, service, downloader, limiter, args.list_workers)
+    else:
+        updated, removed = incremental_sync(state, service, downloader, limiter, args.list_workers)
+
+    # 変更のないファイルはキャッシュから内容を取り出す（キャッシュにないものだけ再取得する）
+    contents = {}
+    for fid, entry in state["files"].items():
+        if fid in updated:
+            continue
+        content = cache.get(fid, entry["info"].get("modifiedTime"))
+        if content is None:
+            downloader.submit(dict(entry["info"]), entry["mimeType"], entry.get("size"))
+        else:
+            contents[fid] = content
+    fetched = {file_info["id"]: file_info for file_info in downloader.collect()}
+
+    data = []
+    writer = JsonlWriter(args.output, fsync_every=args.fsync_every) if args.jsonl else None
+    for fid, entry in state["files"].items():
+        if fid in fetched:
+            file_info = fetched.pop(fid)
+            entry["info"] = {k: v for k, v in file_info.items() if k != "content"}
+        else:
+            file_info = dict(entry["info"], content=contents.pop(fid, ""))
+        if writer:
+            writer.write(file_info)
+        else:
+            data.append(file_info)
+    for fid in removed:
+        cache.remove(fid)
+
+    if writer:
+        writer.close()
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    with open(args.changes_output, "w", encoding="utf-8") as f:
+        json.dump({"updated": sorted(updated), "removed": sorted(removed)}, f, ensure_ascii=False, indent=2)
+    save_sync_state(args.state, state)
+    print(f"同期完了: 更新 {len(updated)} 件 / 削除 {len(removed)} 件 / 全 {len(state['files'])} 件")
+
+def main():
+    parser = argparse.ArgumentParser(description="Google Drive のフォルダ以下のドキュメントを取得して JSON に保存")
+    parser.add_argument("--folder_id", default="179ksE67kVo3PXEZbWJRj2zcg0qUAoWsm",  # TECHFUND Inc.フォルダのID
+                        help="取得対象のフォルダID")
+    parser.add_argument("--output", help="出力ファイル（既定: drive_documents.json、--jsonl 指定時は drive_documents.jsonl）")
+    parser.add_argument("--jsonl", action="store_true",
+                        help="取得が終わったドキュメントから1行ずつ JSONL で追記する（全件をメモリに保持しない）")
+    parser.add_argument("--resume", action="store_true",
+                        help="--jsonl の出力に書き込み済みのドキュメントをスキップして続きから取得する")
+    parser.add_argument("--fsync_every", type=int, default=50, help="JSONL 出力で fsync する間隔（件数）")
+    parser.add_argument("--workers", type=int, default=4, help="内容取得を並列に行うワーカー数")
+    parser.add_argument("--list_workers", type=int, default=DEFAULT_LIST_WORKERS,
+                        help="フォルダの一覧取得を並行して行う数")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help="Drive API へのリクエストレート上限（リクエスト/秒）")
+    parser.add_argument("--parse_workers", type=int, default=os.cpu_count() or 1,
+                        help="PDF・Office ファイルの解析を行うプロセス数（0 の場合は I/O ワーカー上で解析）")
+    parser.add_argument("--parse_timeout", type=float, default=DEFAULT_PARSE_TIMEOUT,
+                        help="1ドキュメントの解析のタイムアウト（秒）")
+    parser.add_argument("--max_pages", type=int, default=DEFAULT_MAX_PAGES,
+                        help="解析する最大ページ数（PDF）・スライド数（PPTX）")
+    parser.add_argument("--max_rows", type=int, default=DEFAULT_MAX_ROWS,
+                        help="解析するシートあたりの最大行数（XLSX）")
+    parser.add_argument("--max_file_size", type=float, default=DEFAULT_MAX_FILE_SIZE / 2**20,
+                        help="取得するファイルサイズの上限（MB、0 で無制限）。超えるファイルはスキップする")
+    parser.add_argument("--chunk_size", type=float, default=DEFAULT_CHUNK_SIZE / 2**20,
+                        help="ダウンロードのチャンクサイズ（MB）")
+    parser.add_argument("--spool_threshold", type=float, default=DEFAULT_SPOOL_THRESHOLD / 2**20,
+                        help="この大きさ（MB）を超えたダウンロードは一時ファイルに書き出す")
+    parser.add_argument("--sync", action="store_true",
+                        help="Changes API で前回からの変更分だけを取得する差分同期モード")
+    parser.add_argument("--state", default="drive_sync_state.json", help="差分同期の状態ファイル")
+    parser.add_argument("--cache_dir", help="抽出済みテキストのキャッシュディレクトリ（--sync の既定は drive_cache）")
+    parser.add_argument("--changes_output", default="drive_changes.json",
+                        help="差分同期で更新・削除されたファイルIDの出力先（下流の取り込みで削除に使う）")
+    args = parser.parse_args()
+
+    if not args.output:
+        args.output = "drive_documents.jsonl" if args.jsonl else "drive_documents.json"
+    pipeline = {"parse_workers": args.parse_workers, "parse_timeout": args.parse_timeout,
+                "max_pages": args.max_pages, "max_rows": args.max_rows,
+                "max_file_size": int(args.max_file_size * 2**20), "chunk_size": int(args.chunk_size * 2**20),
+                "spool_threshold": int(args.spool_threshold * 2**20)}
+
+    limiter = TokenBucket(rate=args.rate, capacity=max(1, int(args.rate * 2)))
+    if args.sync:
+        args.cache_dir = args.cache_dir or "drive_cache"
+        sync(args, limiter, pipeline)
+        return
+
+    cache = ContentCache(args.cache_dir) if args.cache_dir else None
+    if args.jsonl:
+        with JsonlWriter(args.output, resume=args.resume, fsync_every=args.fsync_every) as writer:
+            downloader = ContentDownloader(workers=args.workers, limiter=limiter, cache=cache, writer=writer,
+                                           **pipeline)
+            list_files_in_tree(args.folder_id, downloader=downloader, limiter=limiter, list_workers=args.list_workers)
+            downloader.collect()
+        if downloader.failed:
+            print(f"取得に失敗した {downloader.failed} 件は書き出していません（--resume で再実行すると取り直します）")
+        return
+
+    downloader = ContentDownloader(workers=args.workers, limiter=limiter, cache=cache, **pipeline)
+    list_files_in_tree(args.folder_id, downloader=downloader, limiter=limiter, list_workers=args.list_workers)
+    data = downloader.collect()
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
 if __name__ == '__main__':
-    folder_id = "179ksE67kVo3PXEZbWJRj2zcg0qUAoWsm"  # TECHFUND Inc.フォルダのID
-    data = list_files_recursive(folder_id)
-    with open("drive_documents.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
\ No newline at end of file
+    main()
@@ -1,13 +1,24 @@
+import argparse
+import asyncio
 import requests
 import json
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from requests.adapters import HTTPAdapter, Retry
 from os import getenv
 
+from jsonl_writer import JsonlWriter
+
 # --- 設定 ---
 NOTION_API_KEY = getenv("NOTION_API_KEY")  # ご自身の統合トークンに置き換えてください
 NOTION_VERSION = "2022-06-28"  # 最新の API バージョンを指定
 BASE_URL = "https://api.notion.com/v1/"
+# Notion API のレート制限は平均 3 リクエスト/秒
+DEFAULT_RATE = 3.0
+DEFAULT_CONCURRENCY = 8
+MAX_RETRIES = 6
 
 headers = {
     "Authorization": f"Bearer {NOTION_API_KEY}",
@@ -16,11 +27,20 @@ headers = {
 }
 
 # --- セッションの作成とリトライ設定 ---
-session = requests.Session()
-retries = Retry(total=5, backoff_factor=1, status_forcelist=[502, 503, 504])
-adapter = HTTPAdapter(max_retries=retries)
-session.mount("http://", adapter)
-session.mount("https://", adapter)
+def make_session(status_forcelist=(429, 502, 503, 504)):
+    """
+    リトライ付きのセッションを作成する（429 は Retry-After ヘッダに従って待つ）。
+    search・databases/query は読み取りのみなので POST もリトライ対象にする
+    """
+    session = requests.Session()
+    retries = Retry(total=5, backoff_factor=1, status_forcelist=list(status_forcelist),
+                    allowed_methods=frozenset(["GET", "POST"]))
+    adapter = HTTPAdapter(max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+session = make_session()
 
 # --- ページ検索・取得 ---
 def search_notion_objects(session):
@@ -79,50 +99,423 @@ def get_blocks(session, block_id, start_cursor=None):
         print("ブロック取得エラー:", response.status_code, response.text)
         return None
 
-def get_all_blocks(session, block_id):
-    """ページまたはブロックの子ブロックを全件取得（ページネーション対応）"""
-    all_blocks = []
+def iter_blocks(session, block_id):
+    """ページまたはブロックの子ブロックを、API のページ単位で取得しながら1件ずつ返す（ページネーション対応）"""
     start_cursor = None
     while True:
         data = get_blocks(session, block_id, start_cursor)
         if not data:
             break
-        all_blocks.extend(data.get("results", []))
+        yield from data.get("results", [])
         if data.get("has_more"):
             start_cursor = data.get("next_cursor")
             time.sleep(0.1)
         else:
             break
-    return all_blocks
+
+def get_all_blocks(session, block_id):
+    """ページまたはブロックの子ブロックを全件取得（ページネーション対応）"""
+    return list(iter_blocks(session, block_id))
+
+# --- ブロックタイプごとのテキスト抽出 ---
+def _rich_text(rich_text):
+    return "".join([t.get("plain_text", "") for t in rich_text or []])
+
+def _text_block(value):
+    return _rich_text(value.get("rich_text"))
+
+def _to_do_block(value):
+    text = _text_block(value)
+    if not text:
+        return ""
+    return ("[x] " if value.get("checked") else "[ ] ") + text
+
+def _table_row_block(value):
+    return "\t".join([_rich_text(cell) for cell in value.get("cells", [])])
+
+def _title_block(value):
+    return value.get("title", "")
+
+def _caption_block(value):
+    return _rich_text(value.get("caption"))
+
+def _link_block(value):
+    return " ".join([t for t in (_rich_text(value.get("caption")), value.get("url", "")) if t])
+
+def _equation_block(value):
+    return value.get("expression", "")
+
+# ブロックタイプ → ブロック本体（block[type]）からテキストを取り出す関数
+# 表（table）・列（column_list / column）・同期ブロックなどは子ブロック側にテキストがある
+BLOCK_TEXT_EXTRACTORS = {
+    "paragraph": _text_block,
+    "heading_1": _text_block,
+    "heading_2": _text_block,
+    "heading_3": _text_block,
+    "bulleted_list_item": _text_block,
+    "numbered_list_item": _text_block,
+    "quote": _text_block,
+    "code": _text_block,
+    "toggle": _text_block,
+    "callout": _text_block,
+    "template": _text_block,
+    "to_do": _to_do_block,
+    "table_row": _table_row_block,
+    "child_page": _title_block,
+    "child_database": _title_block,
+    "image": _caption_block,
+    "video": _caption_block,
+    "audio": _caption_block,
+    "file": _caption_block,
+    "pdf": _caption_block,
+    "bookmark": _link_block,
+    "embed": _link_block,
+    "link_preview": _link_block,
+    "equation": _equation_block,
+}
 
 def extract_plain_text(block):
-    """
-    対応ブロックタイプ（paragraph, heading, list_item, quote, code など）から plain text を抽出
-    """
+    """BLOCK_TEXT_EXTRACTORS に対応するブロックタイプから plain text を抽出（未対応のタイプは空文字）"""
     block_type = block.get("type")
-    if block_type in ["paragraph", "heading_1", "heading_2", "heading_3",
-                      "bulleted_list_item", "numbered_list_item", "quote", "code"]:
-        texts = block.get(block_type, {}).get("rich_text", [])
-        return "".join([t.get("plain_text", "") for t in texts])
-    return ""
+    extractor = BLOCK_TEXT_EXTRACTORS.get(block_type)
+    if extractor is None:
+        return ""
+    return extractor(block.get(block_type) or {})
 
-def get_recursive_text(session, block_id):
+def iter_block_texts(session, block_id):
     """
-    指定ブロック（またはページ）の子ブロックを再帰的に取得し、テキストを連結して返す
+    指定ブロック（またはページ）の子孫ブロックのテキストを文書順に1つずつ返すジェネレータ。
+    子ブロックは API のページ単位で取得しながら処理するため、全件をメモリに展開しない
     """
-    text = ""
-    blocks = get_all_blocks(session, block_id)
-    for block in blocks:
+    for block in iter_blocks(session, block_id):
         block_text = extract_plain_text(block)
         if block_text:
-            text += block_text + "\n"
+            yield block_text
         if block.get("has_children", False):
-            child_text = get_recursive_text(session, block["id"])
-            if child_text:
-                text += child_text + "\n"
-    return text.strip()
+            yield from iter_block_texts(session, block["id"])
+
+def join_fragments(fragments, max_bytes=None, truncated=False):
+    """
+    テキスト断片を改行区切りで1回だけ連結する。
+    max_bytes（UTF-8 のバイト数）を超える場合はそこで切り詰め、以降の断片は読まない（取得も行われない）。
+    truncated は呼び出し側ですでに取得を打ち切った場合に指定する
+    """
+    parts = []
+    size = 0
+    for fragment in fragments:
+        if max_bytes:
+            encoded = fragment.encode("utf-8")
+            if size + len(encoded) > max_bytes:
+                head = encoded[:max(max_bytes - size, 0)].decode("utf-8", errors="ignore")
+                if head:
+                    parts.append(head)
+                truncated = True
+                break
+            size += len(encoded) + 1
+        parts.append(fragment)
+    if truncated:
+        parts.append(f"（{max_bytes} バイト以降は省略）")
+    return "\n".join(parts).strip()
+
+def get_recursive_text(session, block_id, max_bytes=None):
+    """
+    指定ブロック（またはページ）の子ブロックを再帰的に取得し、テキストを連結して返す
+    """
+    return join_fragments(iter_block_texts(session, block_id), max_bytes)
+
+# --- 非同期クローラ ---
+class AdaptiveRateLimiter:
+    """
+    asyncio 用のレートリミッタ。リクエストの開始間隔を 1/rate 秒にそろえる。
+    429 を受けたら Retry-After の間すべてのリクエストを止めてレートを半分に下げ、
+    成功が続けば max_rate まで少しずつ戻す。
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=0.3, step=0.05):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.step = step
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    async def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + 1.0 / self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+    def on_rate_limited(self, retry_after):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.next_time = max(self.next_time, time.monotonic() + retry_after)
+        print(f"レート制限（429）: {retry_after:.1f} 秒待機し、{self.rate:.2f} リクエスト/秒に下げます")
+
+# 子の内容が別のページ・ブロックにあり、編集してもこのページの last_edited_time が変わらないブロック
+EXTERNAL_BLOCK_TYPES = {"child_page", "child_database", "synced_block"}
+
+class BlockCache:
+    """
+    ブロックツリーのキャッシュ。{ブロックID: {"last_edited_time", "text": ブロック自身のテキスト,
+    "children": 子ブロックIDのリスト（子を持たないブロックは None）}} を保持する。
+    前回の内容（old）から編集されていないページのブロックを引き継ぎ、
+    今回参照されたブロックだけを blocks に残す（削除されたブロックは保存時に消える）。
+    ブロックの last_edited_time は入れ子の子ブロックを編集しても変わらないため、引き継ぎはページ単位で判定する。
+    last_edited_time は分単位なので、前回の同期開始時刻（since）と同じ分以降に編集されたものは再取得する。
+    """
+
+    def __init__(self, blocks=None, since=None):
+        self.old = blocks or {}
+        self.since = since
+        self.blocks = {}
+
+    def is_fresh(self, last_edited_time, cached_time):
+        return (last_edited_time is not None and last_edited_time == cached_time
+                and not (self.since and last_edited_time >= self.since))
+
+    def reuse_children(self, child_ids):
+        return all(self._carry_over(child_id) for child_id in child_ids)
+
+    def _carry_over(self, block_id):
+        entry = self.old.get(block_id)
+        if entry is None:
+            return False
+        for child_id in entry["children"] or []:
+            if not self._carry_over(child_id):
+                return False
+        self.blocks[block_id] = entry
+        return True
+
+    def put(self, block, children=None):
+        self.blocks[block["id"]] = {"last_edited_time": block.get("last_edited_time"),
+                                    "text": extract_plain_text(block), "children": children}
+
+    def iter_texts(self, child_ids):
+        """キャッシュ済みの子ブロックのテキストを iter_block_texts() と同じ順序で返す"""
+        for child_id in child_ids:
+            entry = self.blocks[child_id]
+            if entry["text"]:
+                yield entry["text"]
+            if entry["children"] is not None:
+                yield from self.iter_texts(entry["children"])
+
+def _retry_after(response, attempt):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return min(2 ** attempt, 30)
+
+class AsyncNotionCrawler:
+    """
+    ページ本文の取得を asyncio で並行して行うクローラ。
+    兄弟ブロックのサブツリーや複数ページを同時に取得し、全体のリクエストレートは AdaptiveRateLimiter で制御する。
+    HTTP 呼び出し自体は requests をスレッドプール上で実行する（セッションはスレッドごとに作成）。
+    429 はセッションでリトライせず、ここで Retry-After に従って待ってから再送する。
+    cache（BlockCache）を指定すると、previous_pages（前回同期時の {ページID: {"last_edited_time", "children"}}）
+    と比べて編集されていないページは取得せずにキャッシュから組み立てる（編集されたページは全ブロックを取得し直す）。
+    今回の各ページの状態は pages に記録する（取得に失敗したページや、子ページ・同期ブロックのように
+    ページの last_edited_time に反映されない内容を含むページは、次回再取得するよう時刻を残さない）。
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, concurrency=DEFAULT_CONCURRENCY, max_retries=MAX_RETRIES,
+                 cache=None, previous_pages=None, max_bytes=None):
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.previous_pages = previous_pages or {}
+        self.pages = {}
+        self.fetched = 0
+        self.reused = 0
+        self.limiter = AdaptiveRateLimiter(rate)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.in_flight = None
+        self._local = threading.local()
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = make_session(status_forcelist=(502, 503, 504))
+        return self._local.session
+
+    def _request(self, method, url, kwargs):
+        return self._session().request(method, url, headers=headers, timeout=30, **kwargs)
+
+    async def request(self, method, path, **kwargs):
+        """API を呼び出して JSON を返す（失敗した場合は None）"""
+        if self.in_flight is None:
+            self.in_flight = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            async with self.in_flight:
+                response = await loop.run_in_executor(self.executor, self._request, method, BASE_URL + path, kwargs)
+            if response.status_code == 429 and attempt < self.max_retries:
+                self.limiter.on_rate_limited(_retry_after(response, attempt))
+                continue
+            if response.status_code != 200:
+                print(f"APIエラー ({path}):", response.status_code, response.text)
+                return None
+            self.limiter.on_success()
+            return response.json()
+        return None
+
+    async def get_all_blocks(self, block_id, status):
+        """
+        子ブロックを全件取得する（カーソルが前のページに依存するため、ページネーションは順に行う）。
+        途中で失敗した場合は取得できた分を返し、status["complete"] を False にする。
+        ページ全体で取得したテキストが max_bytes を超えたら、以降の取得を打ち切る
+        """
+        all_blocks = []
+        start_cursor = None
+        while not status["truncated"]:
+            params = {"page_size": 100}
+            if start_cursor:
+                params["start_cursor"] = start_cursor
+            data = await self.request("GET", f"blocks/{block_id}/children", params=params)
+            if not data:
+                status["complete"] = False
+                break
+            results = data.get("results", [])
+            all_blocks.extend(results)
+            if self.max_bytes:
+                status["bytes"] += sum(len(extract_plain_text(block).encode("utf-8")) + 1 for block in results)
+                if status["bytes"] > self.max_bytes:
+                    status["truncated"] = True
+                    status["complete"] = False
+            if not data.get("has_more"):
+                break
+            start_cursor = data.get("next_cursor")
+        return all_blocks
+
+    async def _subtree(self, block, status):
+        if status["truncated"]:
+            return []
+        return await self.get_fragments(block["id"], status, block)
+
+    async def get_fragments(self, block_id, status, parent=None):
+        """
+        iter_block_texts() と同じ順序でテキスト断片のリストを返す（子を持つ兄弟ブロックは並行して取得する）。
+        parent は block_id のブロック自身（キャッシュへの記録用。ページの場合は None）
+        """
+        blocks = await self.get_all_blocks(block_id, status)
+        child_fragments = await asyncio.gather(*[
+            self._subtree(block, status) for block in blocks if block.get("has_children", False)
+        ])
+        children = iter(child_fragments)
+        fragments = []
+        for block in blocks:
+            block_text = extract_plain_text(block)
+            if block_text:
+                fragments.append(block_text)
+            if block.get("has_children", False):
+                fragments.extend(next(children))
+                if block.get("type") in EXTERNAL_BLOCK_TYPES:
+                    status["external"] = True
+        if self.cache:
+            for block in blocks:
+                if not block.get("has_children", False):
+                    self.cache.put(block)
+            if parent is not None and status["complete"]:
+                self.cache.put(parent, [block["id"] for block in blocks])
+        if parent is None:
+            status["top_level"] = [block["id"] for block in blocks]
+        return fragments
+
+    async def get_recursive_text(self, block_id):
+        status = {"complete": True, "truncated": False, "external": False, "bytes": 0}
+        fragments = await self.get_fragments(block_id, status)
+        return join_fragments(fragments, self.max_bytes, status["truncated"]), status
+
+    async def _page_content(self, page):
+        previous = self.previous_pages.get(page["id"])
+        if (self.cache and previous
+                and self.cache.is_fresh(page.get("last_edited_time"), previous["last_edited_time"])
+                and self.cache.reuse_children(previous["children"])):
+            self.reused += 1
+            self.pages[page["id"]] = previous
+            return join_fragments(self.cache.iter_texts(previous["children"]), self.max_bytes)
+        self.fetched += 1
+        content, status = await self.get_recursive_text(page["id"])
+        if self.cache:
+            # 取得に失敗したページと、他のページの内容を含むページは次回も取得し直す
+            reusable = status["complete"] and not status["external"]
+            self.pages[page["id"]] = {
+                "last_edited_time": page.get("last_edited_time") if reusable else None,
+                "children": status["top_level"]
+            }
+        return content
+
+    async def process_page(self, page):
+        content = await self._page_content(page)
+        return {
+            "id": page["id"],
+            "title": extract_page_title(page),
+            "content": content,
+            "url": page["url"]
+        }
+
+    async def crawl(self, pages, on_document, max_pages_in_flight=None):
+        """
+        複数ページを並行して取得し、取得できたページから on_document(idx, doc) を呼ぶ。
+        同時に処理するページ数は max_pages_in_flight（既定: concurrency）まで。
+        """
+        page_slots = asyncio.Semaphore(max_pages_in_flight or self.concurrency)
+
+        async def run(idx, page):
+            async with page_slots:
+                try:
+                    doc = await self.process_page(page)
+                except Exception as e:
+                    print(f"ページ {page['id']} の処理でエラー発生。スキップします。エラー内容: {e}")
+                    return
+            on_document(idx, doc)
+
+        await asyncio.gather(*[run(idx, page) for idx, page in enumerate(pages)])
+
+    async def query_database(self, database_id):
+        """指定データベース内の全ページを取得（カーソルによるページネーションは順に行う）"""
+        pages = []
+        next_cursor = None
+        while True:
+            payload = {"page_size": 100}
+            if next_cursor:
+                payload["start_cursor"] = next_cursor
+            data = await self.request("POST", f"databases/{database_id}/query", json=payload)
+            if not data:
+                print(f"データベース {database_id} のクエリを中断します")
+                break
+            pages.extend(data.get("results", []))
+            if not data.get("has_more"):
+                break
+            next_cursor = data.get("next_cursor")
+        print(f"データベース {database_id} 内のページ数: {len(pages)}")
+        return pages
+
+    async def query_databases(self, database_ids):
+        """複数のデータベースを並行してクエリし、database_ids の順にページのリストを返す"""
+        return await asyncio.gather(*[self.query_database(database_id) for database_id in database_ids])
+
+    def close(self):
+        self.executor.shutdown()
 
 # --- ページ情報の処理 ---
+def dedupe_pages(pages):
+    """ページIDで重複を除き（最初に現れたものを残す）、(ページのリスト, 除いた件数) を返す"""
+    seen = set()
+    unique = []
+    for page in pages:
+        if page["id"] in seen:
+            continue
+        seen.add(page["id"])
+        unique.append(page)
+    return unique, len(pages) - len(unique)
+
 def extract_page_title(page):
     """ページのタイトルを抽出する。データベースページの場合、titleタイプのプロパティを探索する"""
     props = page.get("properties", {})
@@ -133,11 +526,11 @@ def extract_page_title(page):
                 return title
     return "Untitled Page"
 
-def process_page(session, page):
-    """ページ基本情報と本文（子ブロックのテキスト）を取得して返す"""
+def process_page(session, page, max_bytes=None):
+    """ページ基本情報と本文（子ブロックのテキスト。max_bytes で上限を指定できる）を取得して返す"""
     page_id = page["id"]
     title = extract_page_title(page)
-    content = get_recursive_text(session, page_id)
+    content = get_recursive_text(session, page_id, max_bytes)
     url = page["url"]
     return {
         "id": page_id,
@@ -146,8 +539,78 @@ def process_page(session, page):
         "url": url
     }
 
+# --- 差分同期 ---
+def load_sync_state(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_sync_state(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def sync_minute(timestamp):
+    """Notion の last_edited_time と同じ形式・分単位の UTC 時刻"""
+    return time.strftime("%Y-%m-%dT%H:%M:00.000Z", time.gmtime(timestamp))
+
+def sync_pages(all_pages, args, on_document):
+    """
+    前回の同期状態（ページごとの last_edited_time とブロックキャッシュ）と比べ、
+    編集されたページ・サブツリーだけを取得する。戻り値は {"added", "updated", "removed"} のページIDリスト。
+    """
+    started_at = time.time()
+    state = load_sync_state(args.state) or {}
+    previous_pages = state.get("pages", {})
+    cache = BlockCache(state.get("blocks"), since=state.get("synced_at"))
+    crawler = AsyncNotionCrawler(rate=args.rate, concurrency=args.concurrency, cache=cache,
+                                 previous_pages=previous_pages, max_bytes=args.max_page_bytes)
+    try:
+        asyncio.run(crawler.crawl(all_pages, on_document))
+    finally:
+        crawler.close()
+
+    current_ids = {page["id"] for page in all_pages}
+    changes = {
+        "added": sorted(pid for pid in crawler.pages if pid not in previous_pages),
+        "updated": sorted(pid for pid, entry in crawler.pages.items() if pid in previous_pages
+                          and entry is not previous_pages[pid]),
+        "removed": sorted(pid for pid in previous_pages if pid not in current_ids),
+    }
+    save_sync_state(args.state, {"synced_at": sync_minute(started_at), "pages": crawler.pages,
+                                 "blocks": cache.blocks})
+    print(f"同期完了: 取得 {crawler.fetched} ページ / キャッシュ再利用 {crawler.reused} ページ / "
+          f"追加 {len(changes['added'])} 件 / 更新 {len(changes['updated'])} 件 / 削除 {len(changes['removed'])} 件")
+    return changes
+
 # --- メイン処理 ---
 def main():
+    parser = argparse.ArgumentParser(description="Notion ワークスペースのページ本文を取得して JSON に保存")
+    parser.add_argument("--output", help="出力ファイル（既定: notion_documents.json、--jsonl 指定時は notion_documents.jsonl）")
+    parser.add_argument("--jsonl", action="store_true",
+                        help="取得できたページから1行ずつ JSONL で追記する（全件をメモリに保持しない）")
+    parser.add_argument("--resume", action="store_true",
+                        help="--jsonl の出力に書き込み済みのページをスキップして続きから取得する")
+    parser.add_argument("--fsync_every", type=int, default=50, help="JSONL 出力で fsync する間隔（件数）")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help="Notion API へのリクエストレートの上限（リクエスト/秒）")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="同時に実行するリクエスト数・ページ数の上限")
+    parser.add_argument("--serial", action="store_true",
+                        help="ページ本文を1ブロックずつ順に取得する（従来の動作）")
+    parser.add_argument("--max_page_bytes", type=int,
+                        help="1ページの本文の上限（UTF-8 のバイト数）。超えた分は取得せずに省略する")
+    parser.add_argument("--sync", action="store_true",
+                        help="前回の同期から編集されたページ・ブロックだけを取得する差分同期モード")
+    parser.add_argument("--state", default="notion_sync_state.json",
+                        help="差分同期の状態ファイル（ページの last_edited_time とブロックキャッシュ）")
+    parser.add_argument("--changes_output", default="notion_changes.json",
+                        help="差分同期で追加・更新・削除されたページIDの出力先（下流の取り込みで使う）")
+    args = parser.parse_args()
+    output_filename = args.output or ("notion_documents.jsonl" if args.jsonl else "notion_documents.json")
+
     print("Notion オブジェクトの検索を開始します...")
     all_objects = search_notion_objects(session)
     print(f"全オブジェクト取得件数: {len(all_objects)}")
@@ -167,30 +630,72 @@ def main():
     print(f"スタンドアロンページ数: {len(standalone_pages)}")
     print(f"データベース数: {len(databases)}")
 
-    for db in databases:
-        db_id = db["id"]
-        pages_in_db = query_database(session, db_id)
-        print(f"データベース {db_id} 内のページ数: {len(pages_in_db)}")
-        database_pages.extend(pages_in_db)
+    if args.serial:
+        for db in databases:
+            db_id = db["id"]
+            pages_in_db = query_database(session, db_id)
+            print(f"データベース {db_id} 内のページ数: {len(pages_in_db)}")
+            database_pages.extend(pages_in_db)
+    else:
+        crawler = AsyncNotionCrawler(rate=args.rate, concurrency=args.concurrency)
+        try:
+            for pages_in_db in asyncio.run(crawler.query_databases([db["id"] for db in databases])):
+                database_pages.extend(pages_in_db)
+        finally:
+            crawler.close()
 
-    all_pages = standalone_pages + database_pages
-    print(f"全ページ数: {len(all_pages)}")
+    # 検索結果とデータベースのクエリの両方に現れるページなどは1回だけ取得する
+    all_pages, duplicates = dedupe_pages(standalone_pages + database_pages)
+    print(f"全ページ数: {len(all_pages)}（重複 {duplicates} 件を除外）")
 
-    notion_documents = []
+    # 差分同期では変更のないページもキャッシュから書き出すため、--resume は使わない
+    resume = args.resume and not args.sync
+    writer = JsonlWriter(output_filename, resume=resume, fsync_every=args.fsync_every) if args.jsonl else None
     print("各ページの内容を取得中...")
-    for idx, page in enumerate(all_pages):
+    stats = {"pages": len(all_pages), "duplicates": duplicates, "written": 0}
+    if writer and resume:
+        all_pages = [page for page in all_pages if page["id"] not in writer]
+    stats["resumed"] = stats["pages"] - len(all_pages)
+    # 並行取得でも JSON 出力はページの順序を保つ
+    results = [None] * len(all_pages)
+
+    def on_document(idx, doc):
+        stats["written"] += 1
+        # JSONL 出力の場合は取得できたページから書き出し、本文をメモリに残さない
+        if writer:
+            writer.write(doc)
+        else:
+            results[idx] = doc
+        print(f"[{idx+1}/{len(all_pages)}] 取得: {doc['title']} - content length: {len(doc['content'])}")
+
+    if args.sync:
+        changes = sync_pages(all_pages, args, on_document)
+        with open(args.changes_output, "w", encoding="utf-8") as f:
+            json.dump(changes, f, ensure_ascii=False, indent=2)
+    elif args.serial:
+        for idx, page in enumerate(all_pages):
+            try:
+                on_document(idx, process_page(session, page, args.max_page_bytes))
+            except Exception as e:
+                print(f"ページ {page['id']} の処理でエラー発生。スキップします。エラー内容: {e}")
+    else:
+        crawler = AsyncNotionCrawler(rate=args.rate, concurrency=args.concurrency, max_bytes=args.max_page_bytes)
         try:
-            doc = process_page(session, page)
-            notion_documents.append(doc)
-            print(f"[{idx+1}/{len(all_pages)}] 取得: {doc['title']} - content length: {len(doc['content'])}")
-        except Exception as e:
-            print(f"ページ {page['id']} の処理でエラー発生。スキップします。エラー内容: {e}")
+            asyncio.run(crawler.crawl(all_pages, on_document))
+        finally:
+            crawler.close()
+    notion_documents = [doc for doc in results if doc is not None]
 
-    output_filename = "notion_documents.json"
-    with open(output_filename, "w", encoding="utf-8") as f:
-        json.dump(notion_documents, f, ensure_ascii=False, indent=2)
+    if writer:
+        writer.close()
+    else:
+        with open(output_filename, "w", encoding="utf-8") as f:
+            json.dump(notion_documents, f, ensure_ascii=False, indent=2)
 
     print(f"全ページの内容を {output_filename} に保存しました。")
+    print(f"ページ {stats['pages']} 件（重複スキップ {stats['duplicates']} 件 / 書き込み済みスキップ {stats['resumed']} 件）: "
+          f"出力 {stats['written']} 件 / 失敗 {len(all_pages) - stats['written']} 件 / "
+          f"データベースクエリ {len(databases)} 件")
     session.close()
 
 if __name__ == "__main__":
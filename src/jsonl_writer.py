@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+
+class JsonlWriter:
+    """
+    ドキュメントを1件ずつ JSONL（1行1レコードのコンパクトな JSON）で追記するライタ。
+    fsync_every 件ごとに fsync してチェックポイントを取り、途中で落ちても書き込み済みの分は残る。
+    resume=True の場合は既存ファイルの ID を読み込み、書き込み済みのドキュメントをスキップできるようにする
+    （書き込み途中で切れた最終行は切り詰め、途中の壊れた行は取り除く）。複数スレッドから write() してよい。
+    """
+
+    def __init__(self, path, resume=False, fsync_every=50, id_key="id"):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.id_key = id_key
+        self.written_ids = set()
+        self.count = 0
+        self.lock = threading.Lock()
+        if resume and os.path.exists(path):
+            self._load_existing()
+            self.f = open(path, "a", encoding="utf-8")
+        else:
+            self.f = open(path, "w", encoding="utf-8")
+
+    def _load_existing(self):
+        valid_end = 0
+        corrupt = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 改行で終わらないのは書き込み途中で切れた最終行だけ
+                    break
+                valid_end += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    corrupt += 1
+                    continue
+                self.written_ids.add(record.get(self.id_key))
+        if corrupt:
+            # 途中の壊れた行だけを取り除き、それ以降の書き込み済みの行は残す
+            print(f"{self.path} の壊れた行 {corrupt} 件を取り除きます")
+            self._drop_corrupt_lines()
+        elif valid_end != os.path.getsize(self.path):
+            print(f"{self.path} の末尾の不完全な行を切り詰めます")
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_end)
+        print(f"{self.path} から書き込み済み {len(self.written_ids)} 件を読み込みました")
+
+    def _drop_corrupt_lines(self):
+        """壊れた行と、末尾の不完全な行を除いたファイルに置き換える"""
+        tmp_path = self.path + ".tmp"
+        with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+            for line in src:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    json.loads(line)
+                except ValueError:
+                    continue
+                dst.write(line)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, self.path)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.written_ids
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.f.write(line)
+            self.written_ids.add(record.get(self.id_key))
+            self.count += 1
+            if self.count % self.fsync_every == 0:
+                self._checkpoint()
+
+    def _checkpoint(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        with self.lock:
+            self._checkpoint()
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
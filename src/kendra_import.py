@@ -1,62 +1,433 @@
+import argparse
+import hashlib
 import json
-import boto3
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # 設定値：JSONファイルパスとKendraインデックスIDを指定
 json_file = 'drive_documents.json'
+state_file = 'kendra_sync_state.json'
 index_id = 'd1696ae6-2747-47ed-9d0c-e31c53fd6b53'  # ご自身のKendraインデックスIDに置き換えてください
+region_name = 'us-east-1'
 
-# AWS認証情報は環境変数等で設定済みと仮定（Macの場合も同様）
-kendra = boto3.client('kendra', region_name='us-east-1')
+# BatchPutDocument の上限: 1回あたり10ドキュメント・合計50MB（属性などの分の余裕を見ておく）
+MAX_BATCH_DOCUMENTS = 10
+MAX_BATCH_BYTES = 45 * 1024 * 1024
+# 1ドキュメントあたりの上限（PLAIN_TEXT はこれを超えた分を切り詰める）
+MAX_DOCUMENT_BYTES = 5 * 1024 * 1024
+DEFAULT_WORKERS = 4
+MAX_RETRIES = 6
+THROTTLING_CODES = {"ThrottlingException", "TooManyRequestsException", "RequestLimitExceeded"}
+# FailedDocuments のうち再送しても成功しないもの
+PERMANENT_ERROR_CODES = {"InvalidRequest"}
+# BatchDeleteDocument の上限: 1回あたり10ドキュメント
+MAX_DELETE_DOCUMENTS = 10
+# 前回登録した件数に対してこの割合を超える削除は、入力の取り違えとみなして行わない（--allow_mass_delete で解除）
+MAX_DELETE_RATIO = 0.5
 
-# JSONファイルを読み込み
-with open(json_file, 'r', encoding='utf-8') as f:
-    pages = json.load(f)
+def get_kendra_client(region=region_name):
+    # AWS認証情報は環境変数等で設定済みと仮定（Macの場合も同様）
+    import boto3
+    return boto3.client('kendra', region_name=region)
 
-documents = []
-batch_size = 10
+class StubKendraClient:
+    """
+    オフライン確認用の Kendra クライアント。BatchPutDocument の件数・サイズの上限を検証し、
+    一定の確率でスロットリング（ClientError と同じ形の例外）と FailedDocuments を返す。
+    """
 
-for page in pages:
-    # contentが空の場合はスキップ
+    class ClientError(Exception):
+        def __init__(self, code, message):
+            super().__init__(f"{code}: {message}")
+            self.response = {"Error": {"Code": code, "Message": message}}
+
+    def __init__(self, throttle_rate=0.1, failure_rate=0.05, latency=0.05, seed=None):
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.indexed = {}
+        self.calls = 0
+
+    def batch_put_document(self, IndexId, Documents):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            if len(Documents) > MAX_BATCH_DOCUMENTS:
+                raise self.ClientError("ValidationException", f"too many documents: {len(Documents)}")
+            total = sum(document_size(doc) for doc in Documents)
+            if total > MAX_BATCH_BYTES:
+                raise self.ClientError("ValidationException", f"batch too large: {total} bytes")
+            if self.random.random() < self.throttle_rate:
+                raise self.ClientError("ThrottlingException", "Rate exceeded")
+            failed = []
+            for doc in Documents:
+                if self.random.random() < self.failure_rate:
+                    failed.append({"Id": doc["Id"], "ErrorCode": "InternalError", "ErrorMessage": "stub failure"})
+                else:
+                    self.indexed[doc["Id"]] = doc
+        return {"FailedDocuments": failed}
+
+    def batch_delete_document(self, IndexId, DocumentIdList):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            if len(DocumentIdList) > MAX_DELETE_DOCUMENTS:
+                raise self.ClientError("ValidationException", f"too many documents: {len(DocumentIdList)}")
+            if self.random.random() < self.throttle_rate:
+                raise self.ClientError("ThrottlingException", "Rate exceeded")
+            for doc_id in DocumentIdList:
+                self.indexed.pop(doc_id, None)
+        return {"FailedDocuments": []}
+
+# --- 入力の読み込み（ストリーミング） ---
+def iter_json_array(f, chunk_size=1024 * 1024):
+    """JSON 配列のファイルを全体を読み込まずに要素ごとに返す（先頭の [ は読み込み済みでもよい）"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    while True:
+        # 区切り（空白・先頭の [・,）を読み飛ばす
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,[":
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        if pos < len(buffer):
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                # 値がバッファの終端で終わる場合は続きがあるかもしれないので読み足してから確定する
+                if end < len(buffer) or eof:
+                    yield item
+                    pos = end
+                    continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+        if eof:
+            return
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        chunk_size = max(chunk_size, len(buffer))
+
+def iter_source_documents(path):
+    """get_drive.py / get_notion.py の出力（JSON 配列または JSONL）を1件ずつ返す"""
+    with open(path, 'r', encoding='utf-8') as f:
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        if head == "[":
+            yield from iter_json_array(f)
+            return
+        if head:
+            first_line = head + f.readline()
+            if first_line.strip():
+                yield json.loads(first_line)
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+# --- ドキュメントの組み立てとバッチ分割 ---
+def build_document(page):
+    """取得済みページから BatchPutDocument のドキュメントを作る（contentが空の場合は None）"""
     if not page.get('content'):
-        continue
+        return None
 
     # 追加属性の設定（必要に応じて変更してください）
     attributes = [
         {
             'Key': '_source_uri',
             'Value': {'StringValue': page.get('url', '')}
-        },
-        {
-            'Key': 'createdTime',
-            'Value': {'StringValue': page.get('createdTime', '')}
-        },
-        {
-            'Key': 'modifiedTime',
-            'Value': {'StringValue': page.get('modifiedTime', '')}
-        },
-        {
-            'Key': 'owners',
-            'Value': {
-                'StringValue': ', '.join([owner.get('emailAddress', '') for owner in page.get('owners', [])])
-            }
         }
-        # collaborators等、他に必要な属性があればここに追加可能
     ]
+    # Drive のドキュメント固有の属性（Notion のページにはないので付けない）
+    if 'owners' in page or 'modifiedTime' in page:
+        attributes += [
+            {
+                'Key': 'createdTime',
+                'Value': {'StringValue': page.get('createdTime', '')}
+            },
+            {
+                'Key': 'modifiedTime',
+                'Value': {'StringValue': page.get('modifiedTime', '')}
+            },
+            {
+                'Key': 'owners',
+                'Value': {
+                    'StringValue': ', '.join([owner.get('emailAddress', '') for owner in page.get('owners', [])])
+                }
+            }
+            # collaborators等、他に必要な属性があればここに追加可能
+        ]
+
+    blob = page.get('content').encode('utf-8')
+    if len(blob) > MAX_DOCUMENT_BYTES:
+        print(f"ドキュメント {page.get('id', '')} は {len(blob)} バイトのため {MAX_DOCUMENT_BYTES} バイトに切り詰めます")
+        blob = blob[:MAX_DOCUMENT_BYTES].decode('utf-8', errors='ignore').encode('utf-8')
 
-    document = {
+    return {
         'Id': page.get('id', ''),
         'Title': page.get('title', ''),
-        'Blob': page.get('content').encode('utf-8'),
+        'Blob': blob,
         'ContentType': 'PLAIN_TEXT',
         'Attributes': attributes
     }
-    documents.append(document)
-
-# 10件ごとにバッチで登録
-for i in range(0, len(documents), batch_size):
-    batch = documents[i:i + batch_size]
-    response = kendra.batch_put_document(
-        IndexId=index_id,
-        Documents=batch
-    )
-    print(f"バッチ {i // batch_size + 1}: {response}")
\ No newline at end of file
+
+def document_hash(document):
+    """本文・タイトル・属性から求めるドキュメントのハッシュ（変更の検出に使う）"""
+    h = hashlib.sha256()
+    h.update(document['Blob'])
+    h.update(json.dumps([document.get('Title', ''), document.get('Attributes', [])],
+                        ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    return "sha256:" + h.hexdigest()
+
+def document_size(document):
+    """リクエスト中のドキュメントのおおよそのバイト数（本文・タイトル・属性）"""
+    size = len(document['Blob']) + len(document.get('Title', '').encode('utf-8'))
+    for attribute in document.get('Attributes', []):
+        size += len(attribute['Key']) + len(attribute['Value'].get('StringValue', '').encode('utf-8'))
+    return size
+
+def iter_batches(documents, max_documents=MAX_BATCH_DOCUMENTS, max_bytes=MAX_BATCH_BYTES):
+    """ドキュメントを件数・合計バイト数の両方の上限に収まるバッチにまとめて返す"""
+    batch = []
+    batch_bytes = 0
+    for document in documents:
+        size = document_size(document)
+        if batch and (len(batch) >= max_documents or batch_bytes + size > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(document)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+# --- 登録 ---
+def is_throttling_error(e):
+    code = (getattr(e, "response", None) or {}).get("Error", {}).get("Code")
+    return code in THROTTLING_CODES
+
+class KendraImporter:
+    """
+    BatchPutDocument を最大 workers 件並行して呼び出す。
+    スロットリングは指数バックオフ（ジッター付き）で再試行し、FailedDocuments のうち
+    再送で成功しうるものは失敗したドキュメントだけを集めて再送する。
+    処理待ちのバッチは workers * 2 件までに制限し、入力は読んだ分だけメモリに置く。
+    """
+
+    def __init__(self, client, index_id, workers=DEFAULT_WORKERS, max_retries=MAX_RETRIES):
+        self.client = client
+        self.index_id = index_id
+        self.max_retries = max_retries
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers * 2)
+        self.lock = threading.Lock()
+        self.futures = []
+        self.stats = {"batches": 0, "put": 0, "failed": 0, "throttled": 0, "retried": 0}
+        self.failed = []
+
+    def _count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def _call(self, documents):
+        return self._call_with_backoff(self.client.batch_put_document, IndexId=self.index_id, Documents=documents)
+
+    def _call_with_backoff(self, func, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return func(**kwargs)
+            except Exception as e:
+                if not is_throttling_error(e) or attempt >= self.max_retries:
+                    raise
+                self._count("throttled")
+                time.sleep(min(2 ** attempt, 32) + random.random())
+
+    def put_batch(self, batch_no, documents):
+        """1バッチを登録し、最終的に登録できなかった FailedDocuments のリストを返す"""
+        pending = documents
+        failed = []
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self._call(pending)
+            except Exception as e:
+                print(f"バッチ {batch_no}: 登録エラー {e}")
+                failed.extend({"Id": doc["Id"], "ErrorCode": "RequestFailed", "ErrorMessage": str(e)} for doc in pending)
+                break
+            retryable = []
+            for f in response.get("FailedDocuments", []):
+                if f.get("ErrorCode") in PERMANENT_ERROR_CODES or attempt >= self.max_retries:
+                    failed.append(f)
+                else:
+                    retryable.append(f["Id"])
+            if not retryable:
+                break
+            self._count("retried", len(retryable))
+            retryable = set(retryable)
+            pending = [doc for doc in pending if doc["Id"] in retryable]
+            time.sleep(min(2 ** attempt, 32) + random.random())
+        self._count("put", len(documents) - len(failed))
+        self._count("failed", len(failed))
+        print(f"バッチ {batch_no}: {len(documents)} 件中 {len(documents) - len(failed)} 件登録"
+              + (f"（失敗 {len(failed)} 件）" if failed else ""))
+        return failed
+
+    def _run(self, batch_no, documents):
+        try:
+            failed = self.put_batch(batch_no, documents)
+            if failed:
+                with self.lock:
+                    self.failed.extend(failed)
+        finally:
+            self.slots.release()
+
+    def submit(self, documents):
+        """バッチの登録を予約する（処理待ちが上限に達している場合は空くまで待つ）"""
+        self.slots.acquire()
+        self.stats["batches"] += 1
+        self.futures.append(self.executor.submit(self._run, self.stats["batches"], documents))
+
+    def delete_documents(self, document_ids):
+        """BatchDeleteDocument で削除し、削除できなかった FailedDocuments のリストを返す"""
+        failed = []
+        for i in range(0, len(document_ids), MAX_DELETE_DOCUMENTS):
+            batch = document_ids[i:i + MAX_DELETE_DOCUMENTS]
+            try:
+                response = self._call_with_backoff(self.client.batch_delete_document,
+                                                   IndexId=self.index_id, DocumentIdList=batch)
+            except Exception as e:
+                print(f"削除エラー: {e}")
+                failed.extend({"Id": doc_id, "ErrorCode": "RequestFailed", "ErrorMessage": str(e)} for doc_id in batch)
+                continue
+            failed.extend(response.get("FailedDocuments", []))
+        return failed
+
+    def wait(self):
+        for future in self.futures:
+            future.result()
+        self.futures = []
+        self.executor.shutdown()
+        return self.failed
+
+def load_state(path, index_id):
+    """前回登録したドキュメントの {ID: ハッシュ}（インデックスが異なる場合は空）"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    if state.get("index_id") != index_id:
+        print(f"状態ファイル {path} は別のインデックスのものなので使いません")
+        return {}
+    return state.get("documents", {})
+
+def save_state(path, index_id, documents):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"index_id": index_id, "documents": documents}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def import_documents(paths, client, index_id, workers=DEFAULT_WORKERS, max_documents=MAX_BATCH_DOCUMENTS,
+                     max_bytes=MAX_BATCH_BYTES, max_retries=MAX_RETRIES, state_path=None, full=False,
+                     allow_mass_delete=False):
+    """
+    入力ファイル（複数可）を読みながらバッチに分けて並行して登録し、統計と失敗したドキュメントを返す。
+    state_path を指定すると前回登録時のハッシュと比べて新規・変更されたドキュメントだけを登録し、
+    入力からなくなった（または内容が空になった）ドキュメントはインデックスから削除する。
+    full=True の場合はハッシュを比べずに全件を登録する（削除は行う）。
+    """
+    previous = load_state(state_path, index_id) if state_path else {}
+    importer = KendraImporter(client, index_id, workers, max_retries)
+    hashes = {}
+    skipped = 0
+    unchanged = 0
+
+    def documents():
+        nonlocal skipped, unchanged
+        for path in paths:
+            for page in iter_source_documents(path):
+                document = build_document(page)
+                if document is None:
+                    # contentが空の場合はスキップ
+                    skipped += 1
+                    continue
+                digest = document_hash(document)
+                hashes[document['Id']] = digest
+                if not full and previous.get(document['Id']) == digest:
+                    unchanged += 1
+                    continue
+                yield document
+
+    for batch in iter_batches(documents(), max_documents, max_bytes):
+        importer.submit(batch)
+    failed = importer.wait()
+    stats = dict(importer.stats, skipped=skipped, unchanged=unchanged, deleted=0)
+    if not state_path:
+        return stats, failed
+
+    # 登録に失敗したものは前回の状態のままにして、次回も変更として扱う
+    documents_state = dict(hashes)
+    for f in failed:
+        if f["Id"] in previous:
+            documents_state[f["Id"]] = previous[f["Id"]]
+        else:
+            documents_state.pop(f["Id"], None)
+
+    removed = [doc_id for doc_id in previous if doc_id not in hashes]
+    if removed and not allow_mass_delete and len(removed) > len(previous) * MAX_DELETE_RATIO:
+        print(f"削除対象が {len(removed)} / {len(previous)} 件と多すぎるため削除を行いません"
+              "（入力ファイルを確認し、意図した削除であれば --allow_mass_delete を指定してください）")
+        documents_state.update({doc_id: previous[doc_id] for doc_id in removed})
+    elif removed:
+        delete_failed = importer.delete_documents(removed)
+        for f in delete_failed:
+            documents_state[f["Id"]] = previous[f["Id"]]
+        failed += delete_failed
+        stats["deleted"] = len(removed) - len(delete_failed)
+        stats["failed"] += len(delete_failed)
+    save_state(state_path, index_id, documents_state)
+    return stats, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="取得済みドキュメント（JSON / JSONL）を Kendra インデックスに登録")
+    parser.add_argument("--input", nargs="+", default=[json_file],
+                        help="get_drive.py / get_notion.py の出力ファイル（JSON 配列または JSONL。複数指定可）")
+    parser.add_argument("--index_id", default=index_id, help="Kendra インデックスID")
+    parser.add_argument("--region", default=region_name, help="Kendra のリージョン")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="同時に実行する BatchPutDocument の数")
+    parser.add_argument("--batch_documents", type=int, default=MAX_BATCH_DOCUMENTS,
+                        help="1バッチあたりの最大ドキュメント数")
+    parser.add_argument("--batch_bytes", type=int, default=MAX_BATCH_BYTES,
+                        help="1バッチあたりの最大バイト数")
+    parser.add_argument("--max_retries", type=int, default=MAX_RETRIES,
+                        help="スロットリング・失敗ドキュメントの再試行回数")
+    parser.add_argument("--stub", action="store_true",
+                        help="Kendra を呼ばずにローカルのスタブクライアントで動作を確認する")
+    parser.add_argument("--state", default=state_file,
+                        help="登録済みドキュメントのハッシュを保存する状態ファイル（変更のないドキュメントは登録しない）")
+    parser.add_argument("--full", action="store_true",
+                        help="状態ファイルのハッシュを比べずに全件を登録する")
+    parser.add_argument("--allow_mass_delete", action="store_true",
+                        help=f"前回の {int(MAX_DELETE_RATIO * 100)}%% を超えるドキュメントの削除を許可する")
+    args = parser.parse_args()
+
+    client = StubKendraClient() if args.stub else get_kendra_client(args.region)
+    stats, failed = import_documents(args.input, client, args.index_id, args.workers,
+                                     args.batch_documents, args.batch_bytes, args.max_retries,
+                                     args.state, args.full, args.allow_mass_delete)
+    for f in failed:
+        print(f"登録失敗: {f['Id']} {f.get('ErrorCode')} {f.get('ErrorMessage')}")
+    print(f"登録完了: バッチ {stats['batches']} 件 / 登録 {stats['put']} 件 / 変更なし {stats['unchanged']} 件 / "
+          f"削除 {stats['deleted']} 件 / 失敗 {stats['failed']} 件 / 空のためスキップ {stats['skipped']} 件 / "
+          f"スロットリング {stats['throttled']} 回 / 再送 {stats['retried']} 件")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,14 @@
 ## インデックス自体を試す
 aws kendra query --index-id 08e26a11-26b3-4b12-b8d4-bf7e7382e15f --query-text "NotionDocument"
 
+## ローカル検索（RETRIEVAL_BACKEND=local）用のインデックス作成
+python local_index.py --input drive_documents.json notion_documents.json --output local_index.bin
+
+## デプロイ前にコールドスタート / ウォームスタートの応答時間を確認（クライアントはスタブ）
+python measure_cold_start.py --cold 5 --warm 20 --backend hybrid
+
 ## Lambda登録（まずZip化）
-zip function.zip lambda_function.py
+zip function.zip lambda_function.py local_index.py query_cache.py slack_stream.py local_index.bin
 
 ## 登録時
 aws lambda create-function \
@@ -1,9 +1,21 @@
 import json
 import os
-import boto3
-import openai
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, wait
 import logging
 
+# 初期化フェーズの計測（コールドスタートで何に時間がかかっているかを見るため、ミリ秒で記録する）。
+# boto3 / openai の import とクライアント作成は最初に使うときまで遅らせ、ウォームスタートでは使い回す
+_MODULE_START = time.perf_counter()
+INIT_TIMINGS = {}
+
+from local_index import LocalIndex
+from query_cache import TieredCache, TTLLRUCache, make_shared_cache, normalize_query
+from slack_stream import SlackMessageUpdater
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
@@ -13,51 +25,476 @@ OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 # CHATGPT_MODELは gpt-4 などを利用
 CHATGPT_MODEL = os.environ.get('CHATGPT_MODEL', 'ft:gpt-4o-2024-08-06:techfund-inc::B5TwK9je')
 
-# boto3 クライアント作成
-kendra = boto3.client('kendra', region_name='us-east-1')
-openai.api_key = OPENAI_API_KEY
+# 検索バックエンド: "kendra"（既定）、"kendra_retrieve"（Kendra の Retrieve API。長めの抜粋を返す）、
+# "local"（local_index.py で作成した BM25 インデックス）、または "hybrid"（HYBRID_BACKENDS を並列に検索して統合）
+RETRIEVAL_BACKEND = os.environ.get('RETRIEVAL_BACKEND', 'kendra')
+LOCAL_INDEX_PATH = os.environ.get('LOCAL_INDEX_PATH',
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'local_index.bin'))
+LOCAL_TOP_K = int(os.environ.get('LOCAL_TOP_K', '10'))
+KENDRA_RETRIEVE_PAGE_SIZE = int(os.environ.get('KENDRA_RETRIEVE_PAGE_SIZE', '10'))
+
+# hybrid の設定: 並列に検索するバックエンド（カンマ区切り）、1リクエストあたりの検索の締め切り（ミリ秒）、
+# Reciprocal Rank Fusion の定数 k。締め切りまでに返らなかったバックエンドの結果は待たずに捨てる
+HYBRID_BACKENDS = [name.strip() for name in os.environ.get('HYBRID_BACKENDS', 'kendra,kendra_retrieve').split(',')
+                   if name.strip()]
+RETRIEVAL_DEADLINE_MS = int(os.environ.get('RETRIEVAL_DEADLINE_MS', '1500'))
+# Kendra 呼び出しのタイムアウト（秒）。締め切りを過ぎた呼び出しが長く残らないよう、読み取りは締め切り程度にし再試行しない
+KENDRA_CONNECT_TIMEOUT = float(os.environ.get('KENDRA_CONNECT_TIMEOUT', '1'))
+KENDRA_READ_TIMEOUT = float(os.environ.get('KENDRA_READ_TIMEOUT', str(max(1.0, RETRIEVAL_DEADLINE_MS / 1000))))
+RRF_K = int(os.environ.get('RRF_K', '60'))
+# どのバックエンドも締め切りまでに結果を返さなかったときの応答（回答は生成しない）
+NO_RETRIEVAL_MESSAGE = os.environ.get('NO_RETRIEVAL_MESSAGE', '検索できませんでした。時間をおいてもう一度お試しください。')
+
+# キャッシュ設定（TTL は秒、SIZE はメモリ層の最大件数。CACHE_SHARED に "file" などを指定すると共有層も使う）
+CACHE_EXCERPT_TTL = int(os.environ.get('CACHE_EXCERPT_TTL', '3600'))
+CACHE_EXCERPT_SIZE = int(os.environ.get('CACHE_EXCERPT_SIZE', '256'))
+CACHE_ANSWER_TTL = int(os.environ.get('CACHE_ANSWER_TTL', '86400'))
+CACHE_ANSWER_SIZE = int(os.environ.get('CACHE_ANSWER_SIZE', '256'))
+CACHE_SHARED = os.environ.get('CACHE_SHARED', '')
+
+# プロンプトに入れる検索結果の上限（トークン数の概算）と、重複とみなす抜粋の重なりの割合
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '3000'))
+CONTEXT_DUPLICATE_OVERLAP = float(os.environ.get('CONTEXT_DUPLICATE_OVERLAP', '0.8'))
+# 1 にすると応答に検索結果の生データ（kendra_results）も含める
+INCLUDE_RAW_RESULTS = os.environ.get('INCLUDE_RAW_RESULTS', '0') == '1'
+
+# ストリーミング: ANSWER_STREAMING=1（またはイベントの stream）で回答をトークン単位で受け取る。
+# イベントに slack_channel があれば、生成中の回答で Slack のメッセージを更新する
+ANSWER_STREAMING = os.environ.get('ANSWER_STREAMING', '0') == '1'
+SLACK_BOT_TOKEN = os.environ.get('SLACK_BOT_TOKEN')
+SLACK_UPDATE_INTERVAL = float(os.environ.get('SLACK_UPDATE_INTERVAL', '1.0'))
+SLACK_UPDATE_MIN_CHARS = int(os.environ.get('SLACK_UPDATE_MIN_CHARS', '200'))
+SLACK_ERROR_MESSAGE = os.environ.get('SLACK_ERROR_MESSAGE',
+                                     '回答の作成中にエラーが発生しました。時間をおいてもう一度お試しください。')
+
+# 1 にするとモジュールの読み込み時（Lambda の INIT フェーズ）に boto3 / openai とクライアントを用意する
+# （Provisioned Concurrency などで INIT の時間が応答に含まれない場合向け）
+PREWARM_CLIENTS = os.environ.get('PREWARM_CLIENTS', '0') == '1'
+
+# 1段目: 検索結果（抜粋）、2段目: 最終回答。メモリ層はウォームスタート間で保持される
+_shared_cache = make_shared_cache(CACHE_SHARED)
+excerpt_cache = TieredCache("excerpts", TTLLRUCache(CACHE_EXCERPT_SIZE, CACHE_EXCERPT_TTL), _shared_cache, logger)
+answer_cache = TieredCache("answers", TTLLRUCache(CACHE_ANSWER_SIZE, CACHE_ANSWER_TTL), _shared_cache, logger)
+
+def _record_init(name, start):
+    INIT_TIMINGS[name] = round((time.perf_counter() - start) * 1000, 1)
+
+def _record_first_call(name, start):
+    """コンテナで最初の呼び出しの所要時間だけを記録する（接続の確立などを含む）"""
+    if name not in INIT_TIMINGS:
+        _record_init(name, start)
+
+# 重いクライアントはコンテナごとに1回だけ作る。hybrid 検索では複数のスレッドから同時に呼ばれるので、
+# 互いを待たないようにそれぞれ別のロックで守る
+_kendra_lock = threading.Lock()
+_openai_lock = threading.Lock()
+_local_index_lock = threading.Lock()
+_kendra = None
+_openai = None
+_local_index = None
+
+def get_kendra():
+    global _kendra
+    if _kendra is None:
+        with _kendra_lock:
+            if _kendra is None:
+                start = time.perf_counter()
+                import boto3
+                from botocore.config import Config
+                _record_init("import_boto3_ms", start)
+                start = time.perf_counter()
+                config = Config(connect_timeout=KENDRA_CONNECT_TIMEOUT, read_timeout=KENDRA_READ_TIMEOUT,
+                                retries={'mode': 'standard', 'max_attempts': 1})
+                _kendra = boto3.client('kendra', region_name='us-east-1', config=config)
+                _record_init("kendra_client_ms", start)
+    return _kendra
+
+def get_openai():
+    global _openai
+    if _openai is None:
+        with _openai_lock:
+            if _openai is None:
+                start = time.perf_counter()
+                import openai
+                openai.api_key = OPENAI_API_KEY
+                _record_init("import_openai_ms", start)
+                _openai = openai
+    return _openai
+
+def get_local_index():
+    # ローカルインデックスはコンテナごとに1回だけ開き、ウォームスタートでは使い回す
+    global _local_index
+    if _local_index is None:
+        with _local_index_lock:
+            if _local_index is None:
+                start = time.perf_counter()
+                _local_index = LocalIndex(LOCAL_INDEX_PATH)
+                _record_init("local_index_open_ms", start)
+    return _local_index
+
+def kendra_query(query_text):
+    client = get_kendra()
+    start = time.perf_counter()
+    # Kendraの検索実行
+    kendra_response = client.query(
+        IndexId=KENDRA_INDEX_ID,
+        QueryText=query_text
+    )
+    _record_first_call("first_kendra_query_ms", start)
+    return kendra_response.get('ResultItems', [])
+
+def kendra_retrieve(query_text):
+    """Kendra の Retrieve API（query より長いパッセージを返す）の結果を query の ResultItems の形にそろえる"""
+    client = get_kendra()
+    start = time.perf_counter()
+    kendra_response = client.retrieve(
+        IndexId=KENDRA_INDEX_ID,
+        QueryText=query_text,
+        PageSize=KENDRA_RETRIEVE_PAGE_SIZE
+    )
+    _record_first_call("first_kendra_retrieve_ms", start)
+    return [
+        {
+            "Id": item.get('Id'),
+            "Type": "DOCUMENT",
+            "DocumentId": item.get('DocumentId'),
+            "DocumentTitle": {"Text": item.get('DocumentTitle', '')},
+            "DocumentURI": item.get('DocumentURI', ''),
+            "DocumentExcerpt": {"Text": item.get('Content', '')},
+            "ScoreAttributes": item.get('ScoreAttributes', {"ScoreConfidence": "NOT_AVAILABLE"}),
+        }
+        for item in kendra_response.get('ResultItems', [])
+    ]
+
+def local_query(query_text):
+    return get_local_index().query(query_text, LOCAL_TOP_K)
+
+RETRIEVERS = {
+    "kendra": kendra_query,
+    "kendra_retrieve": kendra_retrieve,
+    "local": local_query,
+}
+
+def _timed(retriever, query_text):
+    start = time.perf_counter()
+    items = retriever(query_text)
+    return items, (time.perf_counter() - start) * 1000
+
+def _fusion_key(item):
+    return item.get('DocumentId') or item.get('DocumentURI') or item.get('Id')
+
+def reciprocal_rank_fusion(ranked_lists, k=RRF_K):
+    """
+    バックエンドごとの検索結果（{バックエンド名: ResultItems}）を Reciprocal Rank Fusion で1つにまとめる。
+    同じドキュメントは1件にし（抜粋は最も長いものを使う）、Score に統合スコア、RetrievalBackends に
+    そのドキュメントを返したバックエンドを入れて、スコアの降順で返す
+    """
+    fused = {}
+    for backend, items in ranked_lists.items():
+        seen = set()
+        for rank, item in enumerate(items, 1):
+            key = _fusion_key(item)
+            if key in seen:
+                continue
+            seen.add(key)
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {"item": item, "score": 0.0, "backends": []}
+            elif len(item.get('DocumentExcerpt', {}).get('Text', '')) > \
+                    len(entry["item"].get('DocumentExcerpt', {}).get('Text', '')):
+                entry["item"] = item
+            entry["score"] += 1.0 / (k + rank)
+            entry["backends"].append(backend)
+    results = []
+    for entry in sorted(fused.values(), key=lambda e: -e["score"]):
+        item = dict(entry["item"])
+        item["Score"] = round(entry["score"], 6)
+        item["RetrievalBackends"] = entry["backends"]
+        results.append(item)
+    return results
+
+def retrieve_hybrid(query_text, backends=None, deadline_ms=RETRIEVAL_DEADLINE_MS):
+    """
+    backends を並列に検索し、deadline_ms までに返った結果だけを統合する。
+    戻り値: (統合した ResultItems, {バックエンド名: {"status": "ok" / "timeout" / "error", ...}})
+    """
+    backends = backends or HYBRID_BACKENDS
+    futures = {}
+    status = {}
+    # スレッドはリクエストごとに用意する（締め切りを過ぎて残った呼び出しが、後のリクエストの検索を待たせないように）
+    executor = ThreadPoolExecutor(max_workers=max(1, len(backends)))
+    try:
+        for name in backends:
+            retriever = RETRIEVERS.get(name)
+            if retriever is None:
+                status[name] = {"status": "error", "error": "unknown backend"}
+                continue
+            futures[executor.submit(_timed, retriever, query_text)] = name
+        done, not_done = wait(futures, timeout=deadline_ms / 1000)
+    finally:
+        executor.shutdown(wait=False)
+
+    ranked_lists = {}
+    for future in done:
+        name = futures[future]
+        try:
+            items, latency_ms = future.result()
+        except Exception as e:
+            logger.warning("retrieval backend %s failed: %s", name, e)
+            status[name] = {"status": "error", "error": str(e)}
+            continue
+        ranked_lists[name] = items
+        status[name] = {"status": "ok", "results": len(items), "latency_ms": round(latency_ms, 1)}
+    for future in not_done:
+        # 実行中のものは止められないが、結果は待たずに捨てる（Kendra の呼び出しは KENDRA_READ_TIMEOUT で終わる）
+        future.cancel()
+        status[futures[future]] = {"status": "timeout"}
+    # 統合の順序がバックエンドの完了順に左右されないよう、指定順に並べ直す
+    ordered = {name: ranked_lists[name] for name in backends if name in ranked_lists}
+    return reciprocal_rank_fusion(ordered), {name: status[name] for name in backends}
+
+def retrieve(query_text, backend):
+    """
+    検索を実行し、(Kendra の ResultItems と同じ形のリスト, バックエンドごとの状態) を返す。
+    "hybrid" 以外は1つのバックエンドを直接呼ぶ（エラーはそのまま送出する）
+    """
+    if backend == 'hybrid':
+        return retrieve_hybrid(query_text)
+    items, latency_ms = _timed(RETRIEVERS[backend], query_text)
+    return items, {backend: {"status": "ok", "results": len(items), "latency_ms": round(latency_ms, 1)}}
+
+# --- プロンプトに入れる検索結果の組み立て ---
+CONFIDENCE_RANK = {"VERY_HIGH": 0, "HIGH": 1, "MEDIUM": 2, "LOW": 3}
+_CJK = re.compile(r"[\u3000-\u30ff\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_WHITESPACE = re.compile(r"\s+")
+
+def estimate_tokens(text):
+    """トークン数の概算（日本語などは1文字1トークン、それ以外は4文字1トークン）"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def _shingles(text, n=3):
+    text = _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip().lower()
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+def _item_score(item):
+    return item.get('Score') if item.get('Score') is not None else item.get('ScoreAttributes', {}).get('ScoreConfidence')
+
+def rank_documents(documents):
+    """スコア順（数値スコアがあれば降順、なければ ScoreConfidence 順。同順位は検索結果の順）に並べる"""
+    def key(pair):
+        index, item = pair
+        score = item.get('Score')
+        if score is not None:
+            return (0, -score, index)
+        confidence = item.get('ScoreAttributes', {}).get('ScoreConfidence')
+        return (1, CONFIDENCE_RANK.get(confidence, len(CONFIDENCE_RANK)), index)
+    return [item for _, item in sorted(enumerate(documents), key=key)]
+
+def build_context(documents, token_budget=CONTEXT_TOKEN_BUDGET, overlap=CONTEXT_DUPLICATE_OVERLAP):
+    """
+    検索結果の抜粋をスコア順に、重なりの大きいもの（文字 3-gram の包含率が overlap 以上）を除いて
+    token_budget に収まるだけ詰める。戻り値: (プロンプトに入れるテキスト, 使った検索結果のリスト)
+    """
+    selected = []
+    kept_shingles = []
+    used_tokens = 0
+    for item in rank_documents(documents):
+        text = item.get('DocumentExcerpt', {}).get('Text', '').strip()
+        if not text:
+            continue
+        shingles = _shingles(text)
+        if any(len(shingles & kept) / min(len(shingles), len(kept)) >= overlap for kept in kept_shingles):
+            continue
+        tokens = estimate_tokens(text) + 1
+        if used_tokens + tokens > token_budget:
+            continue
+        used_tokens += tokens
+        kept_shingles.append(shingles)
+        selected.append((item, text))
+    return "\n".join(text for _, text in selected), [item for item, _ in selected]
+
+def source_summary(documents):
+    """応答に含める検索結果の要約（タイトル・URI・スコア）"""
+    return [
+        {
+            "title": item.get('DocumentTitle', {}).get('Text', ''),
+            "uri": item.get('DocumentURI', ''),
+            "score": _item_score(item),
+        }
+        for item in documents
+    ]
+
+def build_prompt(query_text, retrieved_text):
+    # ChatGPT-4 へのプロンプト作成（日本語で回答するように指示）
+    return (
+        f"メンバーからの質問: {query_text}\n\n"
+        f"その質問に関連するドキュメント情報:\n{retrieved_text}\n\n"
+        "上記の質問に対して、回答を日本語で提供してください。"
+    )
+
+def generate_answer(query_text, retrieved_text, on_delta=None):
+    """
+    回答を生成する。on_delta を指定するとストリーミングで受け取り、断片ごとに on_delta(text) を呼ぶ。
+    戻り値: (回答, 最初のトークンまでの秒数)
+    """
+    client = get_openai()
+    start = time.perf_counter()
+    completion = client.ChatCompletion.create(
+        model=CHATGPT_MODEL,
+        messages=[
+            {"role": "user", "content": build_prompt(query_text, retrieved_text)}
+        ],
+        max_tokens=1500,
+        temperature=0.7,
+        stream=on_delta is not None
+    )
+    if on_delta is None:
+        _record_first_call("first_completion_ms", start)
+        return completion.choices[0].message["content"], time.perf_counter() - start
+
+    parts = []
+    first_token = None
+    for chunk in completion:
+        delta = chunk["choices"][0].get("delta", {}).get("content")
+        if not delta:
+            continue
+        if first_token is None:
+            first_token = time.perf_counter() - start
+            _record_first_call("first_completion_ms", start)
+        parts.append(delta)
+        on_delta(delta)
+    return "".join(parts), first_token if first_token is not None else time.perf_counter() - start
+
+if PREWARM_CLIENTS:
+    get_kendra()
+    get_openai()
+_record_init("module_import_ms", _MODULE_START)
+_cold_start = True
 
 def lambda_handler(event, context):
+    global _cold_start
+    handler_start = time.perf_counter()
+    cold_start, _cold_start = _cold_start, False
+    updater = None
     try:
         query_text = event.get('query', 'default search term')
-        # Kendraの検索実行
-        kendra_response = kendra.query(
-            IndexId=KENDRA_INDEX_ID,
-            QueryText=query_text
-        )
-        documents = kendra_response.get('ResultItems', [])
-        retrieved_text = "\n".join(
-            item.get('DocumentExcerpt', {}).get('Text', '')
-            for item in documents
-        )
-        # ChatGPT-4 へのプロンプト作成（日本語で回答するように指示）
-        prompt = (
-            f"メンバーからの質問: {query_text}\n\n"
-            f"その質問に関連するドキュメント情報:\n{retrieved_text}\n\n"
-            "上記の質問に対して、回答を日本語で提供してください。"
-        )
-        completion = openai.ChatCompletion.create(
-            model=CHATGPT_MODEL,
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1500,
-            temperature=0.7
-        )
-        answer = completion.choices[0].message["content"]
+        # 比較用にイベントでバックエンドを切り替えられる
+        backend = event.get('retrieval_backend', RETRIEVAL_BACKEND)
+        if backend != 'hybrid' and backend not in RETRIEVERS:
+            valid = ", ".join(sorted(RETRIEVERS) + ['hybrid'])
+            logger.warning("unknown retrieval backend: %s", backend)
+            return {
+                "statusCode": 400,
+                "headers": {
+                    "Content-Type": "application/json; charset=UTF-8"
+                },
+                "body": json.dumps({"error": f"unknown retrieval_backend: {backend} (valid: {valid})"},
+                                   ensure_ascii=False)
+            }
+        cache_key = f"{backend}:{normalize_query(query_text)}"
+        cache_status = {"excerpts": "skipped", "answer": "miss"}
+        retrieval_ms = 0.0
+        backend_status = {}
+        ttft_ms = None
+        if event.get('slack_channel') and SLACK_BOT_TOKEN:
+            updater = SlackMessageUpdater(SLACK_BOT_TOKEN, event['slack_channel'], ts=event.get('slack_ts'),
+                                          thread_ts=event.get('slack_thread_ts'), interval=SLACK_UPDATE_INTERVAL,
+                                          min_chars=SLACK_UPDATE_MIN_CHARS)
+        streaming = updater is not None or event.get('stream', ANSWER_STREAMING)
+
+        cached_answer, cache_status["answer"] = answer_cache.get(f"{CHATGPT_MODEL}:{cache_key}")
+        if cached_answer is not None:
+            documents = cached_answer["documents"]
+            answer = cached_answer["answer"]
+            # 回答の生成に使った検索結果を返す（CONTEXT_TOKEN_BUDGET などを変えても回答と食い違わないように）
+            sources = cached_answer.get("sources")
+            if sources is None:
+                sources = source_summary(build_context(documents)[1])
+        else:
+            documents, cache_status["excerpts"] = excerpt_cache.get(cache_key)
+            complete = True
+            if documents is None:
+                start = time.perf_counter()
+                documents, backend_status = retrieve(query_text, backend)
+                retrieval_ms = (time.perf_counter() - start) * 1000
+                # 締め切りに間に合わなかったバックエンドがある結果は、次回は揃うかもしれないのでキャッシュしない
+                complete = all(state["status"] == "ok" for state in backend_status.values())
+                if complete:
+                    excerpt_cache.set(cache_key, documents)
+            logger.info("retrieval backend=%s results=%d latency_ms=%.1f backends=%s", backend, len(documents),
+                        retrieval_ms, json.dumps(backend_status, ensure_ascii=False))
+            if backend_status and not any(state["status"] == "ok" for state in backend_status.values()):
+                # 検索結果なしで回答させると根拠のない回答になるので、LLM は呼ばずに検索できなかったことを返す
+                logger.warning("no retrieval backend answered")
+                if updater:
+                    updater.finish(NO_RETRIEVAL_MESSAGE)
+                return {
+                    "statusCode": 503,
+                    "headers": {
+                        "Content-Type": "application/json; charset=UTF-8"
+                    },
+                    "body": json.dumps({
+                        "query": query_text,
+                        "error": NO_RETRIEVAL_MESSAGE,
+                        "retrieval_backend": backend,
+                        "retrieval_ms": round(retrieval_ms, 1),
+                        "retrieval_backends": backend_status,
+                        "total_ms": round((time.perf_counter() - handler_start) * 1000, 1)
+                    }, ensure_ascii=False)
+                }
+            on_delta = (updater.append if updater else (lambda delta: None)) if streaming else None
+            retrieved_text, context_documents = build_context(documents)
+            logger.info("context documents=%d/%d", len(context_documents), len(documents))
+            sources = source_summary(context_documents)
+            llm_start = time.perf_counter()
+            answer, first_token = generate_answer(query_text, retrieved_text, on_delta)
+            # 最初のトークンまでの時間は、ユーザーが待つ時間としてハンドラの開始から測る
+            ttft_ms = round((llm_start - handler_start + first_token) * 1000, 1)
+            if complete:
+                answer_cache.set(f"{CHATGPT_MODEL}:{cache_key}",
+                                 {"documents": documents, "answer": answer, "sources": sources})
+        if updater:
+            updater.finish(answer)
+        total_ms = round((time.perf_counter() - handler_start) * 1000, 1)
+        logger.info("cache excerpts=%s answer=%s", cache_status["excerpts"], cache_status["answer"])
+        logger.info("latency streaming=%s ttft_ms=%s total_ms=%.1f slack_updates=%s", bool(streaming), ttft_ms,
+                    total_ms, updater.updates if updater else 0)
+        if cold_start:
+            logger.info("init timings %s", json.dumps(INIT_TIMINGS))
+        body = {
+            "query": query_text,
+            "sources": sources,
+            "retrieval_backend": backend,
+            "retrieval_ms": round(retrieval_ms, 1),
+            "retrieval_backends": backend_status,
+            "cache": cache_status,
+            "ttft_ms": ttft_ms,
+            "total_ms": total_ms,
+            "cold_start": cold_start,
+            "chatgpt_answer": answer
+        }
+        if cold_start:
+            body["init_timings"] = dict(INIT_TIMINGS)
+        if event.get('include_raw_results', INCLUDE_RAW_RESULTS):
+            body["kendra_results"] = documents
         return {
             "statusCode": 200,
             "headers": {
                 "Content-Type": "application/json; charset=UTF-8"
             },
-            "body": json.dumps({
-                "query": query_text,
-                "kendra_results": documents,
-                "chatgpt_answer": answer
-            }, ensure_ascii=False)
+            "body": json.dumps(body, ensure_ascii=False, default=str)
         }
     except Exception as e:
         logger.error("Exception occurred", exc_info=True)
+        if updater:
+            # 途中まで書いた回答や「回答を作成中...」のまま止まって見えないよう、エラーで置き換える
+            try:
+                updater.finish(SLACK_ERROR_MESSAGE)
+            except Exception:
+                logger.error("slack error message failed", exc_info=True)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": str(e)})
@@ -0,0 +1,237 @@
+import argparse
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import re
+import struct
+import unicodedata
+
+# 文字 n-gram（日本語）と英数字の単語による BM25 転置インデックス。
+# build_index() で取得済みドキュメントからファイルを作り、LocalIndex で mmap して検索する。
+# Lambda にはこのファイルとインデックスファイルを一緒に配置する（標準ライブラリのみで動く）。
+
+MAGIC = b"BM25IDX1"
+TERM_ENTRY = struct.Struct("<QQI")  # 語のハッシュ, ポスティングの開始位置, 件数
+POSTING = struct.Struct("<II")      # ドキュメント番号, 出現回数
+U32 = struct.Struct("<I")
+U64 = struct.Struct("<Q")
+HEADER_LEN = struct.Struct("<I")
+
+K1 = 1.2
+B = 0.75
+NGRAM = 2
+EXCERPT_CHARS = 300
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+|[^\sa-z0-9]+")
+ASCII_WORD = re.compile(r"[a-z0-9]+")
+PUNCTUATION = re.compile(r"[、。，．・「」『』（）()\[\]【】！？!?：:；;,.\"'`~\-_/\\|*#+=<>&%$@^{}…]+")
+
+def normalize(text):
+    return unicodedata.normalize("NFKC", text).lower()
+
+def tokenize(text):
+    """
+    検索語に分割する。英数字は単語、それ以外（日本語など）は連続する部分を文字 bigram にする
+    （1文字だけの部分はその文字を1語とする）
+    """
+    terms = []
+    for run in WORD_PATTERN.findall(PUNCTUATION.sub(" ", normalize(text))):
+        if ASCII_WORD.fullmatch(run) or len(run) < NGRAM:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + NGRAM] for i in range(len(run) - NGRAM + 1))
+    return terms
+
+def term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+def build_index(documents, path):
+    """
+    documents（{"id", "title", "url", "content"} の dict の列）から索引ファイルを作る。
+    ファイルの構成: MAGIC, ヘッダ長, ヘッダ(JSON), 語の表, ポスティング, 文書長, 本文のオフセット, 本文(UTF-8)
+    """
+    postings = {}
+    doc_meta = []
+    doc_lengths = []
+    texts = []
+    for doc in documents:
+        content = doc.get("content") or ""
+        if not content:
+            continue
+        doc_no = len(doc_meta)
+        doc_meta.append([doc.get("id", ""), doc.get("title", ""), doc.get("url", "")])
+        counts = {}
+        for term in tokenize(doc.get("title", "") + "\n" + content):
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            postings.setdefault(term_hash(term), []).append((doc_no, tf))
+        doc_lengths.append(sum(counts.values()))
+        texts.append(content.encode("utf-8"))
+
+    term_table = bytearray()
+    posting_data = bytearray()
+    for h in sorted(postings):
+        entries = postings[h]
+        term_table += TERM_ENTRY.pack(h, len(posting_data) // POSTING.size, len(entries))
+        for doc_no, tf in entries:
+            posting_data += POSTING.pack(doc_no, tf)
+    text_offsets = bytearray()
+    offset = 0
+    for text in texts:
+        text_offsets += U64.pack(offset)
+        offset += len(text)
+    text_offsets += U64.pack(offset)
+
+    n_docs = len(doc_meta)
+    sections = [term_table, posting_data, b"".join(U32.pack(n) for n in doc_lengths), text_offsets]
+    header = {
+        "n_docs": n_docs,
+        "n_terms": len(postings),
+        "n_postings": len(posting_data) // POSTING.size,
+        "avgdl": (sum(doc_lengths) / n_docs) if n_docs else 0.0,
+        "ngram": NGRAM,
+        "docs": doc_meta,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER_LEN.pack(len(header_bytes)))
+        f.write(header_bytes)
+        for section in sections:
+            f.write(section)
+        for text in texts:
+            f.write(text)
+    print(f"インデックス作成: {n_docs} ドキュメント / {len(postings)} 語 → {path}")
+
+class LocalIndex:
+    """
+    build_index() で作ったファイルを mmap して検索する。語の表はハッシュ順なので二分探索で引き、
+    ポスティングと本文はヒットした分だけ読む（プロセス内で1回開いて使い回す）。
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} はローカル検索インデックスではありません")
+        pos = len(MAGIC)
+        (header_len,) = HEADER_LEN.unpack_from(self.mm, pos)
+        pos += HEADER_LEN.size
+        header = json.loads(self.mm[pos:pos + header_len].decode("utf-8"))
+        pos += header_len
+        self.n_docs = header["n_docs"]
+        self.n_terms = header["n_terms"]
+        self.avgdl = header["avgdl"] or 1.0
+        self.docs = header["docs"]
+        self.terms_pos = pos
+        self.postings_pos = self.terms_pos + self.n_terms * TERM_ENTRY.size
+        self.lengths_pos = self.postings_pos + header["n_postings"] * POSTING.size
+        self.offsets_pos = self.lengths_pos + self.n_docs * U32.size
+        self.texts_pos = self.offsets_pos + (self.n_docs + 1) * U64.size
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def _lookup(self, h):
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_hash, start, count = TERM_ENTRY.unpack_from(self.mm, self.terms_pos + mid * TERM_ENTRY.size)
+            if mid_hash == h:
+                return start, count
+            if mid_hash < h:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def doc_length(self, doc_no):
+        return U32.unpack_from(self.mm, self.lengths_pos + doc_no * U32.size)[0]
+
+    def text(self, doc_no):
+        start, = U64.unpack_from(self.mm, self.offsets_pos + doc_no * U64.size)
+        end, = U64.unpack_from(self.mm, self.offsets_pos + (doc_no + 1) * U64.size)
+        return self.mm[self.texts_pos + start:self.texts_pos + end].decode("utf-8")
+
+    def search(self, query, top_k=10):
+        """BM25 のスコア順に (ドキュメント番号, スコア) のリストを返す"""
+        query_terms = {}
+        for term in tokenize(query):
+            query_terms[term] = query_terms.get(term, 0) + 1
+        scores = {}
+        for term, qtf in query_terms.items():
+            found = self._lookup(term_hash(term))
+            if not found:
+                continue
+            start, count = found
+            idf = math.log(1 + (self.n_docs - count + 0.5) / (count + 0.5))
+            base = self.postings_pos + start * POSTING.size
+            for i in range(count):
+                doc_no, tf = POSTING.unpack_from(self.mm, base + i * POSTING.size)
+                norm = K1 * (1 - B + B * self.doc_length(doc_no) / self.avgdl)
+                scores[doc_no] = scores.get(doc_no, 0.0) + qtf * idf * tf * (K1 + 1) / (tf + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def excerpt(self, doc_no, query, size=EXCERPT_CHARS):
+        """本文中で検索語が最も多く現れる付近を size 文字程度切り出す"""
+        text = self.text(doc_no)
+        if len(text) <= size:
+            return text
+        lowered = normalize(text)
+        positions = []
+        for term in set(tokenize(query)):
+            idx = lowered.find(term)
+            while idx != -1 and len(positions) < 1000:
+                positions.append(idx)
+                idx = lowered.find(term, idx + 1)
+        if not positions or len(lowered) != len(text):
+            # NFKC で長さが変わる場合は位置がずれるので先頭を使う
+            return text[:size]
+        positions.sort()
+        best_start, best_hits, j = positions[0], 0, 0
+        for i, start in enumerate(positions):
+            while positions[j] < start - size:
+                j += 1
+            if i - j + 1 > best_hits:
+                best_hits = i - j + 1
+                best_start = positions[j]
+        start = max(0, min(best_start - size // 4, len(text) - size))
+        return text[start:start + size]
+
+    def query(self, query, top_k=10):
+        """Kendra の query の ResultItems と同じ形（DocumentExcerpt.Text など）で結果を返す"""
+        items = []
+        for doc_no, score in self.search(query, top_k):
+            doc_id, title, url = self.docs[doc_no]
+            items.append({
+                "Id": f"local-{doc_no}",
+                "Type": "DOCUMENT",
+                "DocumentId": doc_id,
+                "DocumentTitle": {"Text": title},
+                "DocumentURI": url,
+                "DocumentExcerpt": {"Text": self.excerpt(doc_no, query)},
+                "ScoreAttributes": {"ScoreConfidence": "NOT_AVAILABLE"},
+                "Score": round(score, 4),
+            })
+        return items
+
+def main():
+    from kendra_import import iter_source_documents
+
+    parser = argparse.ArgumentParser(description="取得済みドキュメントからローカル検索（BM25）用のインデックスを作成")
+    parser.add_argument("--input", nargs="+", default=["drive_documents.json", "notion_documents.json"],
+                        help="get_drive.py / get_notion.py の出力ファイル（JSON 配列または JSONL。複数指定可）")
+    parser.add_argument("--output", default="local_index.bin", help="出力するインデックスファイル")
+    args = parser.parse_args()
+
+    def documents():
+        for path in args.input:
+            yield from iter_source_documents(path)
+
+    build_index(documents(), args.output)
+
+if __name__ == "__main__":
+    main()
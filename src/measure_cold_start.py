@@ -0,0 +1,193 @@
+import argparse
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+# lambda_function.py のコールドスタートとウォームスタートの応答時間をローカルで測る。
+# Kendra と OpenAI のクライアントはスタブに差し替えるので、AWS や OpenAI には接続しない。
+# コールドスタートは1回ごとに新しいプロセスで、ハンドラの import から最初の呼び出しまでを測る。
+#
+#   python measure_cold_start.py --cold 5 --warm 20
+#   python measure_cold_start.py --real_imports --max_cold_ms 1500   # 実際の boto3 / openai を import して測る
+
+class StubKendraClient:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def query(self, IndexId, QueryText, **kwargs):
+        time.sleep(self.latency)
+        return {"ResultItems": [{
+            "Id": "stub-1",
+            "Type": "DOCUMENT",
+            "DocumentId": "stub-1",
+            "DocumentTitle": {"Text": "スタブ"},
+            "DocumentURI": "https://example.com/stub",
+            "DocumentExcerpt": {"Text": f"{QueryText} に関するスタブの抜粋"},
+            "ScoreAttributes": {"ScoreConfidence": "HIGH"},
+        }]}
+
+    def retrieve(self, IndexId, QueryText, PageSize=10, **kwargs):
+        time.sleep(self.latency)
+        return {"ResultItems": [{
+            "Id": "stub-2",
+            "DocumentId": "stub-2",
+            "DocumentTitle": "スタブ",
+            "DocumentURI": "https://example.com/stub2",
+            "Content": f"{QueryText} に関するスタブのパッセージ",
+        }]}
+
+class StubChatCompletion:
+    latency = 0.0
+
+    @classmethod
+    def create(cls, stream=False, **kwargs):
+        time.sleep(cls.latency)
+        answer = "スタブの回答です。"
+        if stream:
+            return iter([{"choices": [{"delta": {"content": answer}}]}])
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message={"content": answer})])
+
+def _patch(name, module, latency):
+    """import された boto3 / openai のクライアントをスタブに差し替える"""
+    if name == "boto3":
+        module.client = lambda service_name, **kwargs: StubKendraClient(latency)
+    elif name == "botocore.config":
+        module.Config = lambda **kwargs: kwargs
+    elif name == "openai":
+        StubChatCompletion.latency = latency
+        module.ChatCompletion = StubChatCompletion
+
+class _PatchingLoader(importlib.abc.Loader):
+    def __init__(self, name, loader, latency):
+        self.name = name
+        self.loader = loader
+        self.latency = latency
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec) if self.loader else None
+
+    def exec_module(self, module):
+        if self.loader:
+            self.loader.exec_module(module)
+        _patch(self.name, module, self.latency)
+
+class StubFinder(importlib.abc.MetaPathFinder):
+    """
+    boto3 / openai の import を横取りする。real_imports=True なら実際のモジュールを読み込んでから
+    クライアントだけ差し替え（import の時間も測れる）、False なら中身のないモジュールを返す。
+    import 自体は lambda_function の中で行われるので、遅延 import の効果がそのまま測れる。
+    """
+
+    NAMES = ("boto3", "openai")
+    # 中身のないモジュールで代用する場合だけ横取りする（実際の boto3 は実際の botocore を使う）
+    STUB_ONLY_NAMES = ("botocore", "botocore.config")
+
+    def __init__(self, real_imports, latency):
+        self.real_imports = real_imports
+        self.latency = latency
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname in self.STUB_ONLY_NAMES and not self.real_imports:
+            return importlib.util.spec_from_loader(fullname, _PatchingLoader(fullname, None, self.latency),
+                                                   is_package=fullname == "botocore")
+        if fullname not in self.NAMES:
+            return None
+        spec = None
+        if self.real_imports:
+            spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+            if spec is None:
+                raise ImportError(f"{fullname} がインストールされていません（--real_imports なしで実行してください）")
+        if spec is None:
+            return importlib.util.spec_from_loader(fullname, _PatchingLoader(fullname, None, self.latency))
+        spec.loader = _PatchingLoader(fullname, spec.loader, self.latency)
+        return spec
+
+def run_child(args):
+    """1つのコンテナに相当するプロセスで、import → 1回目（コールド）→ warm 回の呼び出しを測って JSON で出力する"""
+    sys.meta_path.insert(0, StubFinder(args.real_imports, args.latency_ms / 1000))
+    os.environ.setdefault("CACHE_SHARED", "")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    start = time.perf_counter()
+    import lambda_function
+    import_ms = (time.perf_counter() - start) * 1000
+    lambda_function.logger.setLevel("WARNING")
+
+    invocations = []
+    for i in range(args.warm + 1):
+        # 回答キャッシュに当たらないよう毎回違う質問にする
+        event = {"query": f"計測用の質問 {i}", "retrieval_backend": args.backend}
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler(event, None)
+        invocations.append((time.perf_counter() - start) * 1000)
+        if response["statusCode"] != 200:
+            raise RuntimeError(response["body"])
+    print(json.dumps({
+        "import_ms": import_ms,
+        "invocations": invocations,
+        "init_timings": lambda_function.INIT_TIMINGS,
+    }))
+
+def summarize(label, values):
+    if not values:
+        return
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    print(f"{label:<28} median {statistics.median(values):8.1f} ms   p95 {p95:8.1f} ms   max {values[-1]:8.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="lambda_handler のコールドスタート / ウォームスタートの応答時間をスタブで計測")
+    parser.add_argument("--cold", type=int, default=5, help="コールドスタートの計測回数（回数分のプロセスを起動）")
+    parser.add_argument("--warm", type=int, default=20, help="プロセスごとのウォームスタートの呼び出し回数")
+    parser.add_argument("--backend", default="kendra", help="retrieval_backend（kendra / kendra_retrieve / hybrid など）")
+    parser.add_argument("--latency_ms", type=float, default=0.0, help="スタブのクライアント1回の呼び出しにかける時間（ミリ秒）")
+    parser.add_argument("--real_imports", action="store_true",
+                        help="実際の boto3 / openai を import する（クライアントはスタブ）")
+    parser.add_argument("--max_cold_ms", type=float, default=None,
+                        help="コールドスタート（import + 1回目）の中央値がこれを超えたら終了コード 1 にする")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    child_args = [sys.executable, os.path.abspath(__file__), "--child", "--warm", str(args.warm),
+                  "--backend", args.backend, "--latency_ms", str(args.latency_ms)]
+    if args.real_imports:
+        child_args.append("--real_imports")
+    cold, first, warm = [], [], []
+    init_timings = {}
+    for i in range(args.cold):
+        completed = subprocess.run(child_args, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(completed.stderr, file=sys.stderr)
+            sys.exit(completed.returncode)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        cold.append(result["import_ms"] + result["invocations"][0])
+        first.append(result["invocations"][0])
+        warm.extend(result["invocations"][1:])
+        for name, value in result["init_timings"].items():
+            init_timings.setdefault(name, []).append(value)
+
+    print(f"backend={args.backend} real_imports={args.real_imports} stub_latency_ms={args.latency_ms}")
+    summarize("cold (import + 1st call)", cold)
+    summarize("cold 1st call only", first)
+    summarize("warm", warm)
+    print("初期化フェーズの内訳:")
+    for name, values in init_timings.items():
+        summarize(f"  {name}", values)
+
+    if args.max_cold_ms is not None and statistics.median(cold) > args.max_cold_ms:
+        print(f"コールドスタートの中央値が上限 {args.max_cold_ms} ms を超えています")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# lambda_handler 用のキャッシュ。
+# コンテナ内のメモリ（ウォームスタート間で保持）と、コンテナ間で共有する層の2段構成で、
+# 共有層は SHARED_CACHE_BACKENDS に登録したものから選ぶ（"file" はローカル確認用の代替実装）。
+
+_TRAILING_PUNCTUATION = re.compile(r"[?？!！。．.、,，\s]+$")
+_SPACES = re.compile(r"\s+")
+
+def normalize_query(text):
+    """表記ゆれ（全角・半角、大文字・小文字、空白、末尾の句読点）をそろえたキャッシュキー用の文字列"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = _SPACES.sub(" ", text).strip()
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+class TTLLRUCache:
+    """件数の上限を超えたら最も古く使われたものから捨てる、有効期限付きのメモリキャッシュ"""
+
+    def __init__(self, max_entries=256, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class FileSharedCache:
+    """
+    共有層の代替実装。キーごとに JSON ファイルを置く（ElastiCache や DynamoDB の代わりにローカルで確認する用途）。
+    get / set(key, value, ttl) を持つものであれば共有層として差し替えられる。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("expires_at", 0) < time.time():
+            return None
+        return entry.get("value")
+
+    def set(self, key, value, ttl):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": time.time() + ttl, "value": value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+SHARED_CACHE_BACKENDS = {
+    "file": lambda: FileSharedCache(os.environ.get("CACHE_SHARED_DIR", "/tmp/rag_cache")),
+}
+
+def make_shared_cache(kind):
+    """環境変数などで指定された名前の共有層を作る（空文字・未登録の場合は共有層なし）"""
+    if not kind:
+        return None
+    factory = SHARED_CACHE_BACKENDS.get(kind)
+    if factory is None:
+        raise ValueError(f"未対応の共有キャッシュ: {kind}")
+    return factory()
+
+class TieredCache:
+    """
+    メモリ層 → 共有層の順に引くキャッシュ。共有層でヒットしたものはメモリ層にも入れる。
+    get() は (値, ヒットした層) を返す（層は "memory" / "shared"、ミスの場合は (None, "miss")）。
+    共有層のエラーはミスとして扱い、応答は止めない。
+    """
+
+    def __init__(self, name, memory, shared=None, logger=None):
+        self.name = name
+        self.memory = memory
+        self.shared = shared
+        self.logger = logger
+
+    def _key(self, key):
+        return f"{self.name}:{key}"
+
+    def get(self, key):
+        key = self._key(key)
+        value = self.memory.get(key)
+        if value is not None:
+            return value, "memory"
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                if self.logger:
+                    self.logger.warning("shared cache get failed (%s): %s", self.name, e)
+                value = None
+            if value is not None:
+                self.memory.set(key, value)
+                return value, "shared"
+        return None, "miss"
+
+    def set(self, key, value):
+        key = self._key(key)
+        self.memory.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, self.memory.ttl)
+            except Exception as e:
+                if self.logger:
+                    self.logger.warning("shared cache set failed (%s): %s", self.name, e)
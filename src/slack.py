@@ -1,81 +1,243 @@
+import argparse
+import heapq
 import json
 import os
+import re
 import zipfile
+from contextlib import ExitStack, closing
+
+from slack_index import DAY_FILE_PATTERN, SlackIndex
+from slack_manifest import FileManifest
 
 # 設定
 zip_path = 'slack_export.zip'
-extract_dir = 'slack_export'
 output_file = 'finetune_chat.jsonl'
 your_user_id = "U03RHU7RP"  # 例: "U12345678"
-your_mention = f"<@{your_user_id}>"
-
-# ZIPファイルを解凍
-with zipfile.ZipFile(zip_path, 'r') as z:
-    z.extractall(extract_dir)
-
-# 全メッセージを収集
-all_messages = []
-for root, dirs, files in os.walk(extract_dir):
-    for file in files:
-        if file.endswith('.json'):
-            file_path = os.path.join(root, file)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                try:
-                    data = json.load(f)
-                except Exception:
+
+def _ts_key(msg):
+    return float(msg.get("ts", "0"))
+
+def _load_member(z, name):
+    """ZIP内の1ファイル（1チャンネル×1日）を読み込み、ts順のメッセージリストを返す"""
+    with z.open(name) as f:
+        try:
+            data = json.load(f)
+        except Exception:
+            return []
+    if not isinstance(data, list):
+        return []
+    messages = [m for m in data if isinstance(m, dict)]
+    # 各ファイルは通常ts順だが、念のためファイル単位で整列しておく（全体ソートは行わない）
+    messages.sort(key=_ts_key)
+    return messages
+
+def _group_day_members(z):
+    """ZIP内のチャンネル/日付ファイルを日付ごとにまとめる（ZIP内の並び順を保持）"""
+    day_members = {}
+    for name in z.namelist():
+        match = DAY_FILE_PATTERN.search(name)
+        if match:
+            day_members.setdefault(match.group(1), []).append(name)
+    return day_members
+
+def iter_zip_messages(path):
+    """
+    Slack エクスポートZIPを展開せずに読み込み、全メッセージをts順に逐次返す。
+    日付ファイル名はワークスペースのタイムゾーンで揃っているため、
+    同じ日付のチャンネルファイル群だけをヒープでマージすればよく、
+    メモリ使用量は「同時に開いているチャンネル×日」の分に抑えられる。
+    """
+    with zipfile.ZipFile(path, 'r') as z:
+        day_members = _group_day_members(z)
+        for day in sorted(day_members):
+            streams = [_load_member(z, name) for name in day_members[day]]
+            yield from heapq.merge(*streams, key=_ts_key)
+
+def mention_pattern(user_ids):
+    """対象ユーザーへのメンション <@U...> をまとめて検出する正規表現（1回の走査で全ユーザー分を判定する）"""
+    return re.compile("<@(" + "|".join(re.escape(u) for u in sorted(user_ids)) + ")>")
+
+class ChatPairer:
+    """
+    ts順のメッセージを1件ずつ受け取り、対象ユーザーごとに (ユーザ発話, 本人の返信) の組を組み立てる。
+    - 他ユーザーからの本人宛てメッセージ（メンション付き）をユーザ発話として扱い、連続するものは結合する
+    - 直後の本人からの返信をassistant発話とする（返信がない場合はスキップ）
+    - 前にユーザ発話がない本人の単独メッセージはユーザ発話を空文字とする
+    pending は返信待ちのユーザ発話 {user_id: text}（日付をまたいで引き継ぐ状態）
+    1件のメッセージで処理するのは、投稿者・メンションされたユーザー・返信待ちのユーザーだけなので、
+    対象ユーザー数が増えてもコストはほぼエクスポートの大きさに比例する。
+    """
+
+    def __init__(self, user_ids, pending=None):
+        self.user_ids = set(user_ids)
+        self.pattern = mention_pattern(self.user_ids)
+        self.pending = dict(pending or {})
+
+    def feed(self, msg):
+        """メッセージを1件処理し、確定した (user_id, ユーザ発話, 返信) のリストを返す"""
+        sender = msg.get("user") or ""
+        text = (msg.get("text") or "").strip()
+        mentioned = set(self.pattern.findall(text)) if "<@" in text else set()
+        mentioned.discard(sender)
+
+        targets = mentioned | self.pending.keys()
+        if sender in self.user_ids:
+            targets.add(sender)
+
+        pairs = []
+        for user_id in targets:
+            if user_id in self.pending:
+                if user_id in mentioned:
+                    self.pending[user_id] += "\n" + text
+                    continue
+                if sender == user_id:
+                    pairs.append((user_id, self.pending.pop(user_id), text))
                     continue
-                if isinstance(data, list):
-                    for m in data:
-                        if isinstance(m, dict):
-                            all_messages.append(m)
-
-# タイムスタンプ順にソート
-all_messages.sort(key=lambda m: float(m.get("ts", "0")))
-
-# チャット形式（"messages"リスト）としてjsonl出力
-with open(output_file, 'w', encoding='utf-8') as out_f:
-    i = 0
-    while i < len(all_messages):
-        msg = all_messages[i]
-        sender = msg.get("user", "")
-        text = msg.get("text", "").strip()
-        
-        # 他ユーザーからの「私宛」メッセージ（あなたへのメンションが含まれる場合）をユーザ発話として扱う
-        if sender != your_user_id and your_mention in text:
-            prompt_text = text
-            i += 1
-            # 連続する他ユーザーからの私宛メッセージを結合
-            while i < len(all_messages):
-                next_msg = all_messages[i]
-                if next_msg.get("user", "") != your_user_id and your_mention in next_msg.get("text", ""):
-                    prompt_text += "\n" + next_msg.get("text", "").strip()
-                    i += 1
-                else:
-                    break
-            # 直後の私からの返信をassistant発話とする
-            if i < len(all_messages) and all_messages[i].get("user", "") == your_user_id:
-                assistant_text = all_messages[i].get("text", "").strip()
-                chat_obj = {
-                    "messages": [
-                        {"role": "user", "content": prompt_text},
-                        {"role": "assistant", "content": assistant_text}
-                    ]
-                }
-                out_f.write(json.dumps(chat_obj, ensure_ascii=False) + "\n")
-                i += 1
-            else:
                 # 返信がない場合はスキップ（もしくは補完する方法も検討可能）
-                continue
-        # 私からの単独メッセージの場合（前にユーザ発話がない）
-        elif sender == your_user_id:
-            assistant_text = text
-            chat_obj = {
-                "messages": [
-                    {"role": "user", "content": ""},  # ユーザー発話は空文字
-                    {"role": "assistant", "content": assistant_text}
-                ]
-            }
-            out_f.write(json.dumps(chat_obj, ensure_ascii=False) + "\n")
-            i += 1
+                del self.pending[user_id]
+
+            if user_id in mentioned:
+                self.pending[user_id] = text
+            elif sender == user_id:
+                pairs.append((user_id, "", text))
+        return pairs
+
+def iter_chat_pairs(messages, user_ids):
+    """ts順のメッセージ列から (user_id, ユーザ発話, 本人の返信) の組を逐次返す"""
+    pairer = ChatPairer(user_ids)
+    for msg in messages:
+        yield from pairer.feed(msg)
+
+def chat_line(prompt_text, assistant_text):
+    """チャット形式（"messages"リスト）の jsonl 1行を返す"""
+    chat_obj = {
+        "messages": [
+            {"role": "user", "content": prompt_text},
+            {"role": "assistant", "content": assistant_text}
+        ]
+    }
+    return json.dumps(chat_obj, ensure_ascii=False) + "\n"
+
+def _slim_records(messages, user_ids, pattern):
+    """
+    マニフェストに保存するメッセージレコード [ts, user, text] を返す。
+    ペアリングに本文が必要なのは対象ユーザーの投稿と対象ユーザー宛てメンションだけなので、それ以外は本文を捨てる。
+    """
+    records = []
+    for m in messages:
+        user = m.get("user", "")
+        text = m.get("text", "")
+        keep = user in user_ids or (text and pattern.search(text))
+        records.append([m.get("ts", "0"), user, text if keep else None])
+    return records
+
+def _records_to_messages(records):
+    return [{"ts": ts, "user": user, "text": text} for ts, user, text in records]
+
+def run_incremental(path, user_ids, manifest, writers):
+    """
+    マニフェストを使った差分ビルド。
+    ZIPの中央ディレクトリにあるサイズ・更新日時・CRC32 で変更を検出し、新規・変更ファイルだけを展開する。
+    出力は日付単位でキャッシュし、ファイルに変更がなく、前日から引き継ぐ返信待ち状態も
+    同じ日付はキャッシュ済みの行をそのまま書き出す。
+    """
+    pattern = mention_pattern(user_ids)
+    records = {}
+    changed_days = set()
+    with zipfile.ZipFile(path, 'r') as z:
+        day_members = _group_day_members(z)
+        for day, names in day_members.items():
+            for name in names:
+                info = z.getinfo(name)
+                cached, digest = manifest.lookup(name, info.file_size, list(info.date_time),
+                                                 lambda: f"crc32:{info.CRC:08x}")
+                if cached is None:
+                    cached = _slim_records(_load_member(z, name), user_ids, pattern)
+                    manifest.put(name, info.file_size, list(info.date_time), digest, cached)
+                    changed_days.add(day)
+                records[name] = cached
+    removed = manifest.remove_missing(records)
+    for name in removed:
+        match = DAY_FILE_PATTERN.search(name)
+        if match:
+            changed_days.add(match.group(1))
+    print(f"変更のあった日付: {len(changed_days)} 日 / 削除: {len(removed)} ファイル")
+
+    day_cache = manifest.state.get("days", {})
+    new_day_cache = {}
+    pending = {}
+    rebuilt = 0
+    for day in sorted(day_members):
+        cached = day_cache.get(day)
+        if day not in changed_days and cached and cached["pending_in"] == pending:
+            lines = cached["lines"]
+            pending_out = cached["pending_out"]
         else:
-            i += 1
\ No newline at end of file
+            pairer = ChatPairer(user_ids, pending)
+            streams = [_records_to_messages(records[name]) for name in day_members[day]]
+            lines = {}
+            for msg in heapq.merge(*streams, key=_ts_key):
+                for user_id, prompt_text, assistant_text in pairer.feed(msg):
+                    lines.setdefault(user_id, []).append(chat_line(prompt_text, assistant_text))
+            pending_out = pairer.pending
+            rebuilt += 1
+        new_day_cache[day] = {"pending_in": pending, "pending_out": pending_out, "lines": lines}
+        for user_id, user_lines in lines.items():
+            writers[user_id].writelines(user_lines)
+        pending = pending_out
+    print(f"再生成した日数: {rebuilt} / {len(day_members)}")
+    manifest.state = {"days": new_day_cache}
+
+def output_path_for(output_file, user_id, multi):
+    """対象ユーザーが複数の場合は output_file にユーザーIDを付けたファイルに振り分ける"""
+    if not multi:
+        return output_file
+    stem, ext = os.path.splitext(output_file)
+    return f"{stem}_{user_id}{ext}"
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Slack エクスポートZIPからファインチューニング用 JSONL を生成"
+    )
+    parser.add_argument("--zip_path", default=zip_path,
+                        help="Slack エクスポートZIPのパス")
+    parser.add_argument("--user_id", nargs="+", default=[your_user_id],
+                        help="対象の Slack ユーザー ID（複数指定可。カンマ区切りも可。例: U12345678 U87654321）")
+    parser.add_argument("--output_file", default=output_file,
+                        help="出力する JSONL ファイルのパス（複数ユーザーの場合は <名前>_<ユーザーID>.jsonl に出力）")
+    # 差分の取り方が異なるため、マニフェストとインデックスはどちらか一方だけを指定する
+    incremental = parser.add_mutually_exclusive_group()
+    incremental.add_argument("--manifest",
+                             help="処理済みファイルのマニフェスト（指定すると新規・変更ファイルだけを再パースする）")
+    incremental.add_argument("--index",
+                             help="メッセージの SQLite インデックス（create_RFT_jsonl.py と共有可能）。"
+                                  "指定するとインデックスへのクエリで生成する")
+    args = parser.parse_args()
+
+    user_ids = list(dict.fromkeys(u for arg in args.user_id for u in arg.split(",") if u))
+    multi = len(user_ids) > 1
+
+    # チャット形式（"messages"リスト）としてjsonl出力（1回の走査で各ユーザーのファイルに振り分ける）
+    with ExitStack() as stack:
+        writers = {
+            user_id: stack.enter_context(open(output_path_for(args.output_file, user_id, multi), 'w', encoding='utf-8'))
+            for user_id in user_ids
+        }
+        if args.manifest:
+            manifest = FileManifest(args.manifest, params={"user_ids": sorted(user_ids)})
+            run_incremental(args.zip_path, user_ids, manifest, writers)
+        else:
+            if args.index:
+                index = stack.enter_context(closing(SlackIndex(args.index)))
+                if os.path.exists(args.zip_path):
+                    index.update(args.zip_path)
+                messages = index.iter_chronological()
+            else:
+                messages = iter_zip_messages(args.zip_path)
+            for user_id, prompt_text, assistant_text in iter_chat_pairs(messages, user_ids):
+                writers[user_id].write(chat_line(prompt_text, assistant_text))
+    if args.manifest:
+        manifest.save()
+
+if __name__ == "__main__":
+    main()
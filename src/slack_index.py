@@ -0,0 +1,185 @@
+import glob
+import json
+import os
+import re
+import sqlite3
+import zipfile
+import zlib
+
+# チャンネル/日付ごとのファイル名 (例: general/2024-01-31.json)
+DAY_FILE_PATTERN = re.compile(r"(?:^|/)(\d{4}-\d{2}-\d{2})\.json$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    file_order INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime TEXT NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    path TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    channel TEXT,
+    day TEXT,
+    ts TEXT,
+    ts_num REAL,
+    thread_ts TEXT,
+    user TEXT,
+    text TEXT,
+    PRIMARY KEY (path, pos)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_channel ON messages (channel, ts_num);
+CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages (thread_ts, ts);
+CREATE INDEX IF NOT EXISTS idx_messages_user ON messages (user, thread_ts, ts);
+CREATE INDEX IF NOT EXISTS idx_messages_day ON messages (day, ts_num);
+"""
+
+def file_crc32(path, chunk_size=1024 * 1024):
+    """
+    ファイル内容の CRC32 を ZIP の中央ディレクトリと同じ形式で返す
+    （ZIP と展開済みディレクトリのどちらから更新しても同じ内容なら同じ値になるようにする）
+    """
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            crc = zlib.crc32(chunk, crc)
+    return f"crc32:{crc:08x}"
+
+def _iter_dir_sources(input_dir):
+    """ディレクトリ内の JSON ファイルを (キー, サイズ, 更新時刻, ハッシュ関数, 読み込み関数) で列挙する"""
+    for filepath in glob.glob(os.path.join(input_dir, "**", "*.json"), recursive=True):
+        st = os.stat(filepath)
+        key = os.path.relpath(filepath, input_dir).replace(os.sep, "/")
+
+        def load(filepath=filepath):
+            with open(filepath, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        yield key, st.st_size, str(st.st_mtime_ns), (lambda filepath=filepath: file_crc32(filepath)), load
+
+def _iter_zip_sources(z):
+    """ZIP内の JSON ファイルを列挙する（中央ディレクトリの CRC32 をハッシュとして使う）"""
+    for info in z.infolist():
+        if not info.filename.endswith(".json"):
+            continue
+
+        def load(name=info.filename):
+            with z.open(name) as f:
+                return json.load(f)
+
+        yield (info.filename, info.file_size, "%04d-%02d-%02dT%02d:%02d:%02d" % info.date_time,
+               (lambda info=info: f"crc32:{info.CRC:08x}"), load)
+
+class SlackIndex:
+    """
+    Slack エクスポートのメッセージを SQLite に格納したインデックス。
+    channel / thread_ts / ts / user にインデックスを張り、各変換スクリプトは
+    JSON を読み直さずにクエリだけでデータセットを生成できる。
+    update() はファイル単位のサイズ・更新時刻・ハッシュで差分を判定し、
+    新規・変更ファイルだけを取り込み直す。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def update(self, source):
+        """source（エクスポートZIPまたは展開済みディレクトリ）の内容でインデックスを更新する"""
+        if zipfile.is_zipfile(source):
+            with zipfile.ZipFile(source, 'r') as z:
+                self._update_from(_iter_zip_sources(z))
+        else:
+            self._update_from(_iter_dir_sources(source))
+
+    def _update_from(self, sources):
+        cur = self.conn.cursor()
+        known = {row[0]: row[1:] for row in cur.execute("SELECT path, size, mtime, hash FROM files")}
+        seen = set()
+        loaded = 0
+        for file_order, (key, size, mtime, digest_fn, load) in enumerate(sources):
+            seen.add(key)
+            entry = known.get(key)
+            if entry and entry[0] == size and entry[1] == mtime:
+                cur.execute("UPDATE files SET file_order = ? WHERE path = ?", (file_order, key))
+                continue
+            digest = digest_fn()
+            if entry and entry[2] == digest:
+                cur.execute("UPDATE files SET file_order = ?, size = ?, mtime = ? WHERE path = ?",
+                            (file_order, size, mtime, key))
+                continue
+            try:
+                data = load()
+            except Exception as e:
+                print(f"{key} の読み込みエラー: {e}")
+                data = []
+            cur.execute("DELETE FROM messages WHERE path = ?", (key,))
+            cur.executemany(
+                "INSERT INTO messages (path, pos, channel, day, ts, ts_num, thread_ts, user, text) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._rows(key, data)
+            )
+            cur.execute("INSERT OR REPLACE INTO files (path, file_order, size, mtime, hash) VALUES (?, ?, ?, ?, ?)",
+                        (key, file_order, size, mtime, digest))
+            loaded += 1
+        removed = [key for key in known if key not in seen]
+        for key in removed:
+            cur.execute("DELETE FROM messages WHERE path = ?", (key,))
+            cur.execute("DELETE FROM files WHERE path = ?", (key,))
+        self.conn.commit()
+        print(f"インデックス更新: 取り込み {loaded} ファイル / 再利用 {len(seen) - loaded} ファイル / 削除 {len(removed)} ファイル")
+
+    @staticmethod
+    def _rows(key, data):
+        if not isinstance(data, list):
+            return
+        match = DAY_FILE_PATTERN.search(key)
+        day = match.group(1) if match else None
+        channel = os.path.dirname(key) if match else None
+        for pos, msg in enumerate(data):
+            if not isinstance(msg, dict):
+                continue
+            ts = msg.get("ts")
+            try:
+                ts_num = float(ts if ts is not None else "0")
+            except (TypeError, ValueError):
+                ts_num = 0.0
+            yield (key, pos, channel, day, ts, ts_num, msg.get("thread_ts", ts),
+                   msg.get("user"), msg.get("text"))
+
+    def iter_chronological(self):
+        """
+        日付ファイルのメッセージを (user, text) の dict としてts順に返す。
+        同じtsの場合はファイルの列挙順・ファイル内の位置の順（ZIPからのストリーミングと同じ順序）
+        """
+        cur = self.conn.execute(
+            "SELECT m.user, m.text FROM messages m JOIN files f ON f.path = m.path "
+            "WHERE m.day IS NOT NULL ORDER BY m.day, m.ts_num, f.file_order, m.pos"
+        )
+        for user, text in cur:
+            yield {"user": user or "", "text": text or ""}
+
+    def iter_thread_parents(self):
+        """本文と投稿者のあるスレッド親メッセージ（ts == thread_ts）を読み込み順に返す"""
+        cur = self.conn.execute(
+            "SELECT m.thread_ts, m.user, m.text, m.ts FROM messages m JOIN files f ON f.path = m.path "
+            "WHERE m.ts IS m.thread_ts AND m.text != '' AND m.user != '' "
+            "ORDER BY f.file_order, m.pos"
+        )
+        for thread_ts, user, text, ts in cur:
+            yield thread_ts, {"user": user, "text": text, "ts": ts}
+
+    def iter_user_replies(self, user_id):
+        """指定ユーザーのスレッド返信を thread_ts ごとにts順（同じtsは読み込み順）で返す"""
+        cur = self.conn.execute(
+            "SELECT m.thread_ts, m.text, m.ts FROM messages m JOIN files f ON f.path = m.path "
+            "WHERE m.user = ? AND m.text != '' AND NOT (m.ts IS m.thread_ts) "
+            "ORDER BY m.thread_ts, m.ts, f.file_order, m.pos",
+            (user_id,)
+        )
+        for thread_ts, text, ts in cur:
+            yield thread_ts, {"user": user_id, "text": text, "ts": ts}
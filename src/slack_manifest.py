@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """ファイル内容の SHA-256 を返す"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return "sha256:" + h.hexdigest()
+
+class FileManifest:
+    """
+    処理済みファイルのマニフェスト。
+    各ファイルのパス・サイズ・更新時刻・内容ハッシュと、そのファイルから得られた
+    レコードを JSON で保存し、次回実行時に新規・変更ファイルだけを再パースできるようにする。
+    params が前回と異なる場合（抽出条件が変わった場合など）は空の状態から作り直す。
+    """
+
+    def __init__(self, path, params=None):
+        self.path = path
+        self.params = params or {}
+        self.files = {}
+        self.state = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                try:
+                    data = json.load(f)
+                except Exception as e:
+                    print(f"マニフェスト {path} の読み込みエラー（再構築します）: {e}")
+                    data = {}
+            if data.get("params", {}) == self.params:
+                self.files = data.get("files", {})
+                self.state = data.get("state", {})
+            else:
+                print(f"マニフェスト {path} の条件が変わったため再構築します")
+
+    def lookup(self, key, size, mtime, digest_fn):
+        """
+        保存済みのレコードを返す。
+        サイズと更新時刻が一致すればハッシュ計算なしで再利用し、
+        一致しない場合のみ digest_fn() で内容ハッシュを比較する。
+        戻り値: (records, digest) ─ 再パースが必要な場合 records は None
+        """
+        entry = self.files.get(key)
+        if entry and entry["size"] == size and entry["mtime"] == mtime:
+            return entry["records"], entry["hash"]
+        digest = digest_fn()
+        if entry and entry["hash"] == digest:
+            entry["size"] = size
+            entry["mtime"] = mtime
+            return entry["records"], digest
+        return None, digest
+
+    def put(self, key, size, mtime, digest, records):
+        self.files[key] = {"size": size, "mtime": mtime, "hash": digest, "records": records}
+
+    def remove_missing(self, keys):
+        """keys に含まれないファイルをマニフェストから削除し、削除したエントリを返す"""
+        keys = set(keys)
+        removed = {k: v for k, v in self.files.items() if k not in keys}
+        for k in removed:
+            del self.files[k]
+        return removed
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"params": self.params, "files": self.files, "state": self.state},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,135 @@
+import http.client
+import json
+import logging
+import socket
+import time
+import urllib.error
+import urllib.request
+
+# 生成中の回答を Slack のメッセージに少しずつ反映する。
+# chat.update はレート制限（メソッドごとに毎分数十回程度）があるため、
+# 一定時間・一定文字数ごとにまとめて更新する。
+
+SLACK_API_URL = "https://slack.com/api/"
+# 通信エラー後に次の更新を試すまでの秒数と、最終回答の送信を試す回数
+NETWORK_RETRY_AFTER = 1.0
+FINAL_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+class SlackAPIError(Exception):
+    """
+    Slack API の呼び出しの失敗。retry_after は再試行までの秒数（再試行しても変わらないエラーは None）、
+    outcome_unknown は通信エラーなどで Slack 側で処理されたかどうか分からないことを表す
+    """
+    retry_after = None
+    outcome_unknown = False
+
+def slack_api(method, payload, token, timeout=10):
+    """Slack Web API を JSON で呼び出し、応答の dict を返す（429 の場合は Retry-After を持つ例外を送出）"""
+    request = urllib.request.Request(
+        SLACK_API_URL + method,
+        data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+        headers={"Content-Type": "application/json; charset=utf-8", "Authorization": f"Bearer {token}"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            data = json.loads(response.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        error = SlackAPIError(f"{method}: HTTP {e.code}")
+        if e.code == 429:
+            error.retry_after = float(e.headers.get("Retry-After", "1"))
+        elif e.code >= 500:
+            error.retry_after = NETWORK_RETRY_AFTER
+            error.outcome_unknown = True
+        raise error
+    except (urllib.error.URLError, socket.timeout, ConnectionError, http.client.HTTPException, ValueError) as e:
+        # 通信エラー・応答の破損は少し待てば回復することがあるので、レート制限と同様に待ってから再試行させる。
+        # ただし要求が Slack に届いて処理されている可能性がある
+        error = SlackAPIError(f"{method}: {e}")
+        error.retry_after = NETWORK_RETRY_AFTER
+        error.outcome_unknown = True
+        raise error
+    if not data.get("ok"):
+        raise SlackAPIError(f"{method}: {data.get('error')}")
+    return data
+
+class SlackMessageUpdater:
+    """
+    回答の断片を append() で受け取り、interval 秒ごと（または min_chars 文字以上たまった時点で
+    interval / 4 秒以上空いていれば）に Slack のメッセージを更新する。
+    ts を指定した場合はそのメッセージ（「回答を作成中...」など）を更新し、なければ最初の更新で投稿する。
+    レート制限や通信エラーの場合は Retry-After（通信エラーは NETWORK_RETRY_AFTER 秒）の間は更新せず、
+    その間の断片は次の更新にまとめる。更新の失敗で回答の生成は止めない。
+    chat.postMessage は再送すると同じ回答が重複して投稿されうるので、通信エラーなどで投稿されたか
+    分からない場合は再送せず、このメッセージの更新をやめる（abandoned）。
+    """
+
+    def __init__(self, token, channel, ts=None, thread_ts=None, interval=1.0, min_chars=200, api=slack_api):
+        self.token = token
+        self.channel = channel
+        self.ts = ts
+        self.thread_ts = thread_ts
+        self.interval = interval
+        self.min_chars = min_chars
+        self.api = api
+        self.text = ""
+        self.sent_length = 0
+        self.last_sent = 0.0
+        self.blocked_until = 0.0
+        self.updates = 0
+        self.abandoned = False
+
+    def append(self, delta):
+        self.text += delta
+        now = time.monotonic()
+        if self.abandoned or now < self.blocked_until:
+            return
+        elapsed = now - self.last_sent
+        pending = len(self.text) - self.sent_length
+        if elapsed >= self.interval or (pending >= self.min_chars and elapsed >= self.interval / 4):
+            self._send(self.text + " …")
+
+    def finish(self, text=None, attempts=FINAL_ATTEMPTS):
+        """
+        最終的な回答でメッセージを更新する。レート制限・通信エラーの場合は待ってから attempts 回まで送り直す。
+        送れたかどうかを返す
+        """
+        if text is not None:
+            self.text = text
+        for _ in range(attempts):
+            if self.abandoned:
+                break
+            wait = self.blocked_until - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            if self._send(self.text):
+                return True
+            if self.blocked_until <= time.monotonic():
+                # 再試行しても変わらないエラー（channel_not_found など）
+                break
+        logger.error("slack final update failed")
+        return False
+
+    def _send(self, text):
+        try:
+            if self.ts is None:
+                payload = {"channel": self.channel, "text": text}
+                if self.thread_ts:
+                    payload["thread_ts"] = self.thread_ts
+                self.ts = self.api("chat.postMessage", payload, self.token)["ts"]
+            else:
+                self.api("chat.update", {"channel": self.channel, "ts": self.ts, "text": text}, self.token)
+        except SlackAPIError as e:
+            if self.ts is None and e.outcome_unknown:
+                self.abandoned = True
+                logger.warning("slack post may or may not have been delivered, not retrying: %s", e)
+                return False
+            if e.retry_after:
+                self.blocked_until = time.monotonic() + e.retry_after
+            logger.warning("slack update failed: %s", e)
+            return False
+        self.updates += 1
+        self.sent_length = len(self.text)
+        self.last_sent = time.monotonic()
+        return True